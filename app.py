@@ -1,22 +1,48 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, Response
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, Response, send_file, abort, stream_with_context
 from functools import wraps
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import hmac
+import io
 import random
+import re
 import requests
 import json
+import logging
+import math
+import mmap
 import os
+import secrets
+import sqlite3
 import sys
+import threading
+import time
 from datetime import datetime, timedelta
 from xml.etree import ElementTree
 from werkzeug.security import generate_password_hash, check_password_hash
+from requests.adapters import HTTPAdapter
+
+try:
+    import fcntl
+except ImportError:  # Windows: workers don't coordinate library syncs
+    fcntl = None
 
 # Force unbuffered output for Docker logs
 sys.stdout.reconfigure(line_buffering=True)
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+DATA_DIR = os.environ.get('DATA_DIR', os.path.join(os.path.dirname(__file__), 'data'))
 CONFIG_PATH = os.path.join(DATA_DIR, 'config.json')
 WATCHLIST_FILE = os.path.join(DATA_DIR, 'watchlist.json')
 USERS_FILE = os.path.join(DATA_DIR, 'users.json')
 HISTORY_FILE = os.path.join(DATA_DIR, 'pick_history.json')
+LIBRARY_CACHE_DIR = os.path.join(DATA_DIR, 'library_cache')
+METRICS_DIR = os.path.join(DATA_DIR, 'metrics')
+DB_PATH = os.path.join(DATA_DIR, 'mediaroulette.db')
+POSTER_CACHE_DIR = os.path.join(DATA_DIR, 'posters')
 
 PLEX_PRODUCT = "MediaRouletteApp"
 PLEX_CLIENT_IDENTIFIER = "mediaroulette-client-001"
@@ -25,33 +51,499 @@ PLEX_DEVICE_NAME = "MediaRoulette"
 PLEX_DEVICE = "PythonApp"
 PLEX_VERSION = "1.0"
 
+# Picks kept per user in the session history unless changed in settings,
+# the most that can be kept, and how many the picker shows per page
 DEFAULT_SESSION_LIMIT = 20
+MAX_SESSION_LIMIT = 500
+HISTORY_PAGE_SIZE = 20
+
+WATCHLIST_PAGE_SIZE = 24
+
+# Per-browser spin state (filters, results, seen items) unused for this long is pruned
+SPIN_STATE_RETENTION_DAYS = 30
+
+# /api/spin: most items one request may pick, and the spin state shared by
+# API-key clients (kept apart from every browser's seen items)
+SPIN_API_MAX_PICKS = 100
+API_STATE_ID = 'api'
+
+# Library cache: how long a synced section stays fresh, how many sections are
+# kept in memory, and whether snapshots are shared between workers via data/
+LIBRARY_CACHE_TTL = int(os.environ.get('LIBRARY_CACHE_TTL', 300))
+LIBRARY_CACHE_MAX_ENTRIES = int(os.environ.get('LIBRARY_CACHE_MAX_ENTRIES', 16))
+LIBRARY_CACHE_DISK = os.environ.get('LIBRARY_CACHE_DISK', 'true').lower() == 'true'
+# Cached sections are refreshed incrementally; a full refetch still happens this often
+LIBRARY_FULL_SYNC_INTERVAL = int(os.environ.get('LIBRARY_FULL_SYNC_INTERVAL', 21600))
+# Sections are fetched from Plex in pages of this many items
+LIBRARY_PAGE_SIZE = int(os.environ.get('LIBRARY_PAGE_SIZE', 500))
+# Background refresh of the configured libraries; backs off up to the maximum
+# while Plex is failing or slower than LIBRARY_REFRESH_SLOW_SECONDS
+LIBRARY_REFRESH_INTERVAL = int(os.environ.get('LIBRARY_REFRESH_INTERVAL', 300))
+LIBRARY_REFRESH_MAX_BACKOFF = int(os.environ.get('LIBRARY_REFRESH_MAX_BACKOFF', 1800))
+LIBRARY_REFRESH_SLOW_SECONDS = 10
+
+# Connections kept open per Plex host, and how many sections are fetched at once
+PLEX_POOL_SIZE = int(os.environ.get('PLEX_POOL_SIZE', 10))
+PLEX_FETCH_WORKERS = int(os.environ.get('PLEX_FETCH_WORKERS', 4))
+
+# Cold-cache spins without a keyword sample a few random items from Plex
+# instead of downloading every match; SPIN_SAMPLE_OVERFETCH extra items per
+# section make up for ones already seen or rejected by the local filters
+LIGHTWEIGHT_SPIN = os.environ.get('LIGHTWEIGHT_SPIN', 'true').lower() in ('1', 'true', 'yes')
+SPIN_SAMPLE_OVERFETCH = 10
+
+# How often each worker re-measures the latency of a server's connections,
+# and how long a single probe may take
+PLEX_PROBE_INTERVAL = int(os.environ.get('PLEX_PROBE_INTERVAL', 600))
+PLEX_PROBE_TIMEOUT = 3
+
+# Circuit breaker: after this many Plex requests in a row fail, requests to
+# that server fail immediately (and cached libraries are served) until one
+# trial request succeeds; trials are let through every PLEX_BREAKER_COOLDOWN seconds
+PLEX_BREAKER_THRESHOLD = int(os.environ.get('PLEX_BREAKER_THRESHOLD', 3))
+PLEX_BREAKER_COOLDOWN = int(os.environ.get('PLEX_BREAKER_COOLDOWN', 30))
+
+# Posters are transcoded by Plex at twice the 180px width they are shown at
+# and kept in an on-disk LRU cache of at most POSTER_CACHE_MAX_MB
+POSTER_WIDTH = 360
+POSTER_HEIGHT = 540
+POSTER_CACHE_MAX_MB = int(os.environ.get('POSTER_CACHE_MAX_MB', 200))
+POSTER_MAX_AGE = 30 * 86400
+# Posters from URLs without a version (saved by older releases) can change
+# in Plex without their URL changing, so they are refetched after a day
+POSTER_UNVERSIONED_TTL = 86400
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
 
 app = Flask(__name__)
+
 app.secret_key = os.environ.get('SECRET_KEY', 'mediaroulette-dev-key-change-in-prod')
 
-# Ensure data directory and files exist
+# All Plex and plex.tv traffic goes through one keep-alive session so
+# connections are reused across requests instead of reopened per call
+plex_http = requests.Session()
+_plex_adapter = HTTPAdapter(pool_connections=PLEX_POOL_SIZE, pool_maxsize=PLEX_POOL_SIZE)
+plex_http.mount('http://', _plex_adapter)
+plex_http.mount('https://', _plex_adapter)
+
+_fetch_executor = ThreadPoolExecutor(max_workers=PLEX_FETCH_WORKERS, thread_name_prefix='plex-fetch')
+
+# Ensure data directories exist
 os.makedirs(DATA_DIR, exist_ok=True)
-if not os.path.exists(CONFIG_PATH):
-    with open(CONFIG_PATH, 'w') as f:
-        json.dump({}, f)
-if not os.path.exists(WATCHLIST_FILE):
-    with open(WATCHLIST_FILE, 'w') as f:
-        json.dump([], f)
+os.makedirs(LIBRARY_CACHE_DIR, exist_ok=True)
+os.makedirs(POSTER_CACHE_DIR, exist_ok=True)
+os.makedirs(METRICS_DIR, exist_ok=True)
+
+# Spin and sync progress goes through this logger so LOG_LEVEL controls how
+# chatty it is; DEBUG shows every spin
+log = logging.getLogger('mediaroulette')
+if not log.handlers:
+    _log_handler = logging.StreamHandler(sys.stdout)
+    _log_handler.setFormatter(logging.Formatter('[%(asctime)s] [%(process)d] [%(levelname)s] %(message)s'))
+    log.addHandler(_log_handler)
+    log.propagate = False
+    if isinstance(logging.getLevelName(LOG_LEVEL), int):
+        log.setLevel(LOG_LEVEL)
+    else:
+        log.setLevel(logging.INFO)
+        log.warning("Unknown LOG_LEVEL %r, using INFO", LOG_LEVEL)
+
+# Metrics in the Prometheus text format. Each worker records into its own
+# registry and writes it to data/metrics/<pid>.json at most every
+# METRICS_FLUSH_SECONDS; /metrics adds up the files of all live workers so a
+# scrape sees the whole server, not just the worker that answered it.
+METRICS_FLUSH_SECONDS = 10
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+_metrics_flushed_at = 0.0
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values = {}   # label values -> count
+        _metrics[name] = self
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with _metrics_lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}   # label values -> [count per bucket..., count above the last, sum]
+        _metrics[name] = self
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with _metrics_lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 2)
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def time(self, **labels):
+        """Context manager that observes how long its block took"""
+        return _Timer(self, labels)
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+PLEX_REQUEST_SECONDS = Histogram('mediaroulette_plex_request_seconds', 'Time taken by requests to Plex servers',
+                                 ('server', 'endpoint'))
+PLEX_RESPONSE_BYTES = Histogram('mediaroulette_plex_response_bytes', 'Size of Plex response bodies',
+                                ('endpoint',), SIZE_BUCKETS)
+PLEX_ERRORS = Counter('mediaroulette_plex_errors_total', 'Plex requests that could not connect or timed out',
+                      ('server', 'endpoint'))
+CACHE_REQUESTS = Counter('mediaroulette_cache_requests_total', 'Cache lookups by cache and result (hit, miss, stale)',
+                         ('cache', 'result'))
+SPIN_SECONDS = Histogram('mediaroulette_spin_seconds', 'End-to-end time to pick items for a spin', ('source',))
+SPIN_STAGE_SECONDS = Histogram('mediaroulette_spin_stage_seconds', 'Time spent in each stage of a spin', ('stage',))
+LIBRARY_SYNC_SECONDS = Histogram('mediaroulette_library_sync_seconds', 'Time taken to sync a library section with Plex',
+                                 ('kind',))
+PLEX_SHARED_REQUESTS = Counter('mediaroulette_plex_shared_requests_total',
+                               'Plex fetches answered by joining an identical fetch already in flight', ('kind',))
+PLEX_CIRCUIT_REJECTIONS = Counter('mediaroulette_plex_circuit_rejections_total',
+                                  'Plex requests failed without trying because the server is unhealthy', ('server',))
+STORAGE_SECONDS = Histogram('mediaroulette_storage_seconds', 'Time spent reading and writing cache files',
+                            ('operation',))
+
+def flush_metrics(force=False):
+    """Write this worker's metrics to data/metrics so /metrics in any worker can include them"""
+    global _metrics_flushed_at
+    if not force and time.time() - _metrics_flushed_at < METRICS_FLUSH_SECONDS:
+        return
+    _metrics_flushed_at = time.time()
+    with _metrics_lock:
+        state = {name: [[list(key), value] for key, value in metric.values.items()] for name, metric in _metrics.items()}
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        log.warning("Failed to write metrics: %s", e)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # Exists but belongs to someone else
+    return True
+
+def render_metrics():
+    """All live workers' metrics, added up, in the Prometheus text format"""
+    flush_metrics(force=True)
+    totals = {}
+    for entry in os.scandir(METRICS_DIR):
+        name, ext = os.path.splitext(entry.name)
+        if ext != '.json' or not name.isdigit():
+            continue
+        if not _pid_alive(int(name)):
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(entry.path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for metric_name, series in state.items():
+            merged = totals.setdefault(metric_name, {})
+            for key, value in series:
+                key = tuple(key)
+                if isinstance(value, list):
+                    current = merged.get(key)
+                    merged[key] = value if current is None else [a + b for a, b in zip(current, value)]
+                else:
+                    merged[key] = merged.get(key, 0) + value
+
+    def label_text(pairs):
+        escaped = [k + '="' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"' for k, v in pairs]
+        return '{' + ','.join(escaped) + '}' if escaped else ''
+
+    lines = []
+    for name, metric in _metrics.items():
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for key, value in sorted(totals.get(name, {}).items()):
+            labels = list(zip(metric.labels, key))
+            if metric.kind == 'counter':
+                lines.append(f"{name}{label_text(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + ('+Inf',), value[:-1]):
+                cumulative += count
+                le = bound if isinstance(bound, str) else f"{bound:g}"
+                lines.append(f"{name}_bucket{label_text(labels + [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{label_text(labels)} {value[-1]}")
+            lines.append(f"{name}_count{label_text(labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+def _import_json_files(conn):
+    """One-time import of the JSON files used before the SQLite database.
+
+    Returns the number of files imported.
+    """
+    imported = []
+
+    def read_json(path, default):
+        if not os.path.exists(path):
+            return default
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            imported.append(path)
+            return data
+        except ValueError:
+            log.warning("Skipping unreadable %s during migration", os.path.basename(path))
+            return default
+
+    for key, value in read_json(CONFIG_PATH, {}).items():
+        conn.execute('INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+    for username, user in read_json(USERS_FILE, {}).items():
+        conn.execute('INSERT OR REPLACE INTO users (username, data) VALUES (?, ?)', (username, json.dumps(user)))
+    for item in read_json(WATCHLIST_FILE, []):
+        if item.get('title') and item.get('year'):
+            conn.execute('INSERT OR IGNORE INTO watchlist (title, year, data) VALUES (?, ?, ?)',
+                         (item['title'], str(item['year']), json.dumps(item)))
+    for username, history in read_json(HISTORY_FILE, {}).items():
+        conn.executemany('INSERT INTO pick_history (username, data) VALUES (?, ?)',
+                         [(username, json.dumps(item)) for item in history[-DEFAULT_SESSION_LIMIT:]])
+    return len(imported)
+
+# Watchlist items are identified by their Plex ratingKey. Items saved before
+# the key was stored still have it in their Plex link; the few without a link
+# fall back to title and year.
+_PLEX_LINK_RATING_KEY_RE = re.compile(r"%2Flibrary%2Fmetadata%2F(\d+)")
+
+def watchlist_item_key(item):
+    rating_key = item.get('rating_key')
+    if not rating_key:
+        match = _PLEX_LINK_RATING_KEY_RE.search(item.get('link') or '')
+        rating_key = match.group(1) if match else None
+    if rating_key:
+        return f"plex:{rating_key}"
+    return f"title:{item.get('title')}|{item.get('year')}"
+
+def _key_watchlist_items(conn):
+    conn.execute('ALTER TABLE watchlist ADD COLUMN item_key TEXT')
+    for row in conn.execute('SELECT id, data FROM watchlist').fetchall():
+        conn.execute('UPDATE watchlist SET item_key = ? WHERE id = ?',
+                     (watchlist_item_key(json.loads(row['data'])), row['id']))
+    # An item renamed in Plex may have been saved under both titles
+    conn.execute('DELETE FROM watchlist WHERE id NOT IN (SELECT MIN(id) FROM watchlist GROUP BY item_key)')
+    conn.execute('DROP INDEX watchlist_title_year')
+    conn.execute('CREATE UNIQUE INDEX watchlist_item_key ON watchlist (item_key)')
+
+# SQLite database for all persistent state. The schema is versioned with
+# PRAGMA user_version; each entry in DB_MIGRATIONS upgrades it by one and is
+# either SQL or a function that receives the connection.
+DB_MIGRATIONS = [
+    """
+    CREATE TABLE spin_state (
+        state_id TEXT PRIMARY KEY,
+        filters TEXT NOT NULL DEFAULT '{}',
+        results TEXT NOT NULL DEFAULT '[]',
+        all_seen INTEGER NOT NULL DEFAULT 0,
+        total_matching INTEGER NOT NULL DEFAULT 0,
+        show_history INTEGER NOT NULL DEFAULT 0,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE seen_items (
+        state_id TEXT NOT NULL,
+        rating_key TEXT NOT NULL,
+        PRIMARY KEY (state_id, rating_key)
+    ) WITHOUT ROWID;
+    """,
+    """
+    ALTER TABLE spin_state ADD COLUMN remaining INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE spin_state ADD COLUMN seen_epoch INTEGER NOT NULL DEFAULT 0;
+    """,
+    """
+    CREATE TABLE config (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE users (
+        username TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE watchlist (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        year TEXT NOT NULL,
+        data TEXT NOT NULL
+    );
+    CREATE UNIQUE INDEX watchlist_title_year ON watchlist (title, year);
+    CREATE TABLE pick_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX pick_history_username ON pick_history (username, id);
+    """,
+    _import_json_files,
+    """
+    CREATE TABLE generations (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    INSERT INTO generations (name, value) VALUES ('config', 0), ('users', 0);
+    """,
+    # Pick history becomes a ring per user: pick number seq lives in slot
+    # seq % limit, so recording a pick overwrites the oldest one in place
+    f"""
+    DROP INDEX pick_history_username;
+    ALTER TABLE pick_history RENAME TO pick_history_log;
+    CREATE TABLE pick_history (
+        username TEXT NOT NULL,
+        slot INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (username, slot)
+    ) WITHOUT ROWID;
+    CREATE INDEX pick_history_seq ON pick_history (username, seq);
+    INSERT INTO pick_history (username, slot, seq, data)
+        SELECT username, seq % {DEFAULT_SESSION_LIMIT}, seq, data FROM (
+            SELECT username, data,
+                   ROW_NUMBER() OVER (PARTITION BY username ORDER BY id) AS seq,
+                   COUNT(*) OVER (PARTITION BY username) AS total
+            FROM pick_history_log)
+        WHERE seq > total - {DEFAULT_SESSION_LIMIT};
+    DROP TABLE pick_history_log;
+    """,
+    _key_watchlist_items,
+]
+
+# JSON files imported by _import_json_files; renamed afterwards so they are kept as a backup
+LEGACY_JSON_FILES = [CONFIG_PATH, USERS_FILE, WATCHLIST_FILE, HISTORY_FILE]
+
+_db_local = threading.local()
+
+def get_db():
+    """Return this thread's connection to the database"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _db_local.conn = conn
+    return conn
+
+class db_transaction:
+    """Run a block of statements atomically: ``with db_transaction() as conn: ...``"""
+
+    def __enter__(self):
+        self.conn = get_db()
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+def init_db():
+    with db_transaction() as conn:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        ran_json_import, imported_json = False, 0
+        for i, migration in enumerate(DB_MIGRATIONS[version:], start=version + 1):
+            if migration is _import_json_files:
+                ran_json_import, imported_json = True, migration(conn)
+            elif callable(migration):
+                migration(conn)
+            else:
+                for statement in migration.split(';'):
+                    if statement.strip():
+                        conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {i}')
+        cutoff = time.time() - SPIN_STATE_RETENTION_DAYS * 86400
+        conn.execute('DELETE FROM seen_items WHERE state_id IN (SELECT state_id FROM spin_state WHERE updated_at < ?)', (cutoff,))
+        conn.execute('DELETE FROM spin_state WHERE updated_at < ?', (cutoff,))
+    if ran_json_import:
+        for path in LEGACY_JSON_FILES:
+            if os.path.exists(path):
+                os.replace(path, f"{path}.migrated")
+    if imported_json:
+        log.info("Migrated JSON data files into mediaroulette.db")
+
+init_db()
+
+# Config and users are read on nearly every request but written rarely, so
+# each worker keeps a decoded copy and only re-reads a table after a writer
+# (in any worker) has bumped its row in the generations table.
+_table_cache = {}
+
+def bump_generation(conn, name):
+    conn.execute('UPDATE generations SET value = value + 1 WHERE name = ?', (name,))
+
+def cached_table(name, load):
+    """Return load()'s result for a table, reloading only when its generation has changed"""
+    generation = get_db().execute('SELECT value FROM generations WHERE name = ?', (name,)).fetchone()[0]
+    cached = _table_cache.get(name)
+    if cached is None or cached[0] != generation:
+        # Tagged with the generation read *before* loading, so a write that
+        # lands in between just causes one extra reload on the next call
+        cached = (generation, load())
+        _table_cache[name] = cached
+    return cached[1]
+
+def _load_users():
+    rows = get_db().execute('SELECT username, data FROM users')
+    return {row['username']: json.loads(row['data']) for row in rows}
 
 def load_users():
-    if not os.path.exists(USERS_FILE):
-        return {}
-    with open(USERS_FILE, 'r') as f:
-        return json.load(f)
+    return {username: dict(user) for username, user in cached_table('users', _load_users).items()}
+
+def get_user(username):
+    user = cached_table('users', _load_users).get(username)
+    return dict(user) if user else None
 
 def save_users(users):
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=2)
+    with db_transaction() as conn:
+        conn.execute('DELETE FROM users')
+        conn.executemany('INSERT INTO users (username, data) VALUES (?, ?)',
+                         [(username, json.dumps(user)) for username, user in users.items()])
+        bump_generation(conn, 'users')
+
+def delete_users():
+    with db_transaction() as conn:
+        conn.execute('DELETE FROM users')
+        bump_generation(conn, 'users')
 
 def is_setup_complete():
-    users = load_users()
-    return len(users) > 0
+    return bool(cached_table('users', _load_users))
 
 def login_required(f):
     @wraps(f)
@@ -63,50 +555,171 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def api_auth_required(f):
+    """Allow a logged-in browser session or a request carrying the API key from settings"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get('logged_in') and is_setup_complete():
+            return f(*args, **kwargs)
+        api_key = load_config().get('api_key')
+        supplied = request.headers.get('X-Api-Key') or request.args.get('api_key', '')
+        if api_key and hmac.compare_digest(supplied, api_key):
+            return f(*args, **kwargs)
+        return jsonify({'error': 'Authentication required'}), 401
+    return decorated_function
+
 RATING_OPTIONS = [
     'G', 'PG', 'PG-13', 'R', 'NC-17', 'Not Rated', 'Unrated',
     'TV-Y', 'TV-Y7', 'TV-G', 'TV-PG', 'TV-14', 'TV-MA'
 ]
 
+def _load_config():
+    rows = get_db().execute('SELECT key, value FROM config')
+    config = {row['key']: json.loads(row['value']) for row in rows}
+    # Library title -> key, built once per config change instead of scanned per lookup
+    library_keys = {}
+    for lib in config.get('plex_libraries', []):
+        library_keys.setdefault(lib['title'], lib['key'])
+    return config, library_keys
+
 def load_config():
-    if not os.path.exists(CONFIG_PATH):
-        return {}
-    with open(CONFIG_PATH, 'r') as f:
-        return json.load(f)
+    """Return a copy of the config that the caller is free to modify and pass to save_config"""
+    return dict(cached_table('config', _load_config)[0])
 
 def save_config(config):
-    with open(CONFIG_PATH, 'w') as f:
-        json.dump(config, f, indent=2)
+    """Store the config, writing only keys that were added, changed or removed"""
+    with db_transaction() as conn:
+        stored = {row['key']: row['value'] for row in conn.execute('SELECT key, value FROM config')}
+        changed = False
+        for key in stored.keys() - config.keys():
+            conn.execute('DELETE FROM config WHERE key = ?', (key,))
+            changed = True
+        for key, value in config.items():
+            encoded = json.dumps(value)
+            if stored.get(key) != encoded:
+                conn.execute('INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)', (key, encoded))
+                changed = True
+        if changed:
+            bump_generation(conn, 'config')
 
-def load_watchlist():
-    if not os.path.exists(WATCHLIST_FILE):
-        return []
-    with open(WATCHLIST_FILE, 'r') as f:
-        return json.load(f)
+def iter_watchlist():
+    """Yield every saved item, oldest first, without loading them all at once"""
+    for row in get_db().execute('SELECT data FROM watchlist ORDER BY id'):
+        item = json.loads(row['data'])
+        item['poster'] = proxy_poster_url(item.get('poster'))
+        yield item
 
-def load_pick_history(username):
-    """Load pick history for a user from file"""
-    if not os.path.exists(HISTORY_FILE):
-        return []
+def load_watchlist_page(page):
+    """One page of the watchlist, oldest first, plus the number of saved items"""
+    conn = get_db()
+    total = conn.execute('SELECT COUNT(*) FROM watchlist').fetchone()[0]
+    rows = conn.execute('SELECT item_key, data FROM watchlist ORDER BY id LIMIT ? OFFSET ?',
+                        (WATCHLIST_PAGE_SIZE, (page - 1) * WATCHLIST_PAGE_SIZE)).fetchall()
+    watchlist = []
+    for row in rows:
+        item = json.loads(row['data'])
+        item['poster'] = proxy_poster_url(item.get('poster'))
+        item['item_key'] = row['item_key']
+        watchlist.append(item)
+    return watchlist, total
+
+def add_watchlist_item(item):
+    """Add an item unless it is already saved"""
+    get_db().execute('INSERT OR IGNORE INTO watchlist (item_key, title, year, data) VALUES (?, ?, ?, ?)',
+                     (watchlist_item_key(item), item['title'], str(item['year']), json.dumps(item)))
+
+def remove_watchlist_item(item_key):
+    get_db().execute('DELETE FROM watchlist WHERE item_key = ?', (item_key,))
+
+def get_history_limit(config):
+    """Number of picks kept per user, as set in settings"""
     try:
-        with open(HISTORY_FILE, 'r') as f:
-            all_history = json.load(f)
-        return all_history.get(username, [])
-    except:
-        return []
+        limit = int(config.get('history_limit') or DEFAULT_SESSION_LIMIT)
+    except (TypeError, ValueError):
+        limit = DEFAULT_SESSION_LIMIT
+    return min(max(limit, 1), MAX_SESSION_LIMIT)
 
-def save_pick_history(username, history):
-    """Save pick history for a user to file"""
-    all_history = {}
-    if os.path.exists(HISTORY_FILE):
-        try:
-            with open(HISTORY_FILE, 'r') as f:
-                all_history = json.load(f)
-        except:
-            pass
-    all_history[username] = history[-DEFAULT_SESSION_LIMIT:]
-    with open(HISTORY_FILE, 'w') as f:
-        json.dump(all_history, f, indent=2)
+def load_pick_history(username, page=1):
+    """Load one page of a user's picks, newest page first and oldest first within it.
+
+    Returns the page and the number of picks in the whole history.
+    """
+    conn = get_db()
+    total = conn.execute('SELECT COUNT(*) FROM pick_history WHERE username = ?', (username,)).fetchone()[0]
+    rows = conn.execute('SELECT data FROM pick_history WHERE username = ? ORDER BY seq DESC LIMIT ? OFFSET ?',
+                        (username, HISTORY_PAGE_SIZE, (page - 1) * HISTORY_PAGE_SIZE)).fetchall()
+    history = [json.loads(row['data']) for row in reversed(rows)]
+    for item in history:
+        item['poster'] = proxy_poster_url(item.get('poster'))
+    return history, total
+
+def append_pick_history(username, items, limit):
+    """Record new picks for a user, overwriting the oldest once ``limit`` are kept"""
+    with db_transaction() as conn:
+        last = conn.execute('SELECT MAX(seq) FROM pick_history WHERE username = ?', (username,)).fetchone()[0] or 0
+        conn.executemany('INSERT OR REPLACE INTO pick_history (username, slot, seq, data) VALUES (?, ?, ?, ?)',
+                         [(username, seq % limit, seq, json.dumps(item))
+                          for seq, item in enumerate(items, start=last + 1)])
+
+def resize_pick_history(limit):
+    """Trim every user's history to ``limit`` picks and move them to their slots in the new ring"""
+    with db_transaction() as conn:
+        conn.execute("""DELETE FROM pick_history WHERE seq <= (
+                            SELECT MAX(seq) FROM pick_history AS p WHERE p.username = pick_history.username) - ?""",
+                     (limit,))
+        # The kept picks have consecutive seqs, so their new slots are unique.
+        # Going through negative slots avoids clashing with the old ones.
+        conn.execute('UPDATE pick_history SET slot = -1 - seq % ?', (limit,))
+        conn.execute('UPDATE pick_history SET slot = -1 - slot')
+
+def clear_pick_history(username):
+    get_db().execute('DELETE FROM pick_history WHERE username = ?', (username,))
+
+def get_state_id():
+    """Return the id of this browser's server-side spin state; the cookie carries only this"""
+    if 'state_id' not in session:
+        session['state_id'] = secrets.token_urlsafe(16)
+    return session['state_id']
+
+def load_spin_state(state_id):
+    row = get_db().execute('SELECT * FROM spin_state WHERE state_id = ?', (state_id,)).fetchone()
+    if row is None:
+        return {'filters': {}, 'results': [], 'all_seen': False, 'total_matching': 0, 'remaining': 0,
+                'seen_epoch': 0, 'show_history': False}
+    return {
+        'filters': json.loads(row['filters']),
+        'results': [dict(r, poster=proxy_poster_url(r.get('poster'))) for r in json.loads(row['results'])],
+        'all_seen': bool(row['all_seen']),
+        'total_matching': row['total_matching'],
+        'remaining': row['remaining'],
+        'seen_epoch': row['seen_epoch'],
+        'show_history': bool(row['show_history'])
+    }
+
+def save_spin_state(state_id, state):
+    get_db().execute(
+        """INSERT OR REPLACE INTO spin_state
+           (state_id, filters, results, all_seen, total_matching, remaining, seen_epoch, show_history, updated_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (state_id, json.dumps(state['filters']), json.dumps(state['results']), int(state['all_seen']),
+         state['total_matching'], state['remaining'], state['seen_epoch'], int(state['show_history']), time.time())
+    )
+
+def load_seen_keys(state_id):
+    rows = get_db().execute('SELECT rating_key FROM seen_items WHERE state_id = ?', (state_id,))
+    return {row[0] for row in rows}
+
+def is_seen_key(state_id, rating_key):
+    row = get_db().execute('SELECT 1 FROM seen_items WHERE state_id = ? AND rating_key = ?',
+                           (state_id, str(rating_key))).fetchone()
+    return row is not None
+
+def add_seen_keys(state_id, rating_keys):
+    get_db().executemany('INSERT OR IGNORE INTO seen_items (state_id, rating_key) VALUES (?, ?)',
+                         [(state_id, str(k)) for k in rating_keys])
+
+def clear_seen_keys(state_id):
+    get_db().execute('DELETE FROM seen_items WHERE state_id = ?', (state_id,))
 
 @app.route('/setup', methods=['GET', 'POST'])
 def setup():
@@ -135,7 +748,7 @@ def setup():
             save_users(users)
             session['logged_in'] = True
             session['username'] = username
-            print(f"Admin account created: {username}", flush=True)
+            log.info("Admin account created: %s", username)
             return redirect(url_for('plex_login'))
     
     return render_template('setup.html', error=error)
@@ -153,17 +766,16 @@ def login():
         username = request.form.get('username', '').strip()
         password = request.form.get('password', '')
         
-        users = load_users()
-        user = users.get(username)
+        user = get_user(username)
         
         if user and check_password_hash(user['password_hash'], password):
             session['logged_in'] = True
             session['username'] = username
-            print(f"User logged in: {username}", flush=True)
+            log.info("User logged in: %s", username)
             return redirect(url_for('index'))
         else:
             error = 'Invalid username or password.'
-            print(f"Failed login attempt for: {username}", flush=True)
+            log.warning("Failed login attempt for: %s", username)
     
     return render_template('login.html', error=error)
 
@@ -172,20 +784,25 @@ def app_logout():
     username = session.get('username', 'unknown')
     session.pop('logged_in', None)
     session.pop('username', None)
-    print(f"User logged out: {username}", flush=True)
+    log.info("User logged out: %s", username)
     return redirect(url_for('login'))
 
 @app.route('/reset_password', methods=['POST'])
 @login_required
 def reset_password():
-    """Delete users.json to allow creating a new admin account"""
+    """Delete the admin account to allow creating a new one"""
     username = session.get('username', 'unknown')
-    if os.path.exists(USERS_FILE):
-        os.remove(USERS_FILE)
-        print(f"[MediaRoulette] Admin account reset by: {username}", flush=True)
+    delete_users()
+    log.warning("Admin account reset by: %s", username)
     session.clear()
     return redirect(url_for('setup'))
 
+@app.cli.command('reset-admin')
+def reset_admin_command():
+    """Delete the admin account so a new one can be created on the next page load"""
+    delete_users()
+    log.warning("Admin account deleted. Reload MediaRoulette to create a new one.")
+
 @app.route('/plex_login')
 @login_required
 def plex_login():
@@ -199,12 +816,12 @@ def plex_login():
         'Accept': 'application/json'
     }
     try:
-        response = requests.post("https://plex.tv/api/v2/pins", headers=headers, timeout=10)
+        response = plex_http.post("https://plex.tv/api/v2/pins", headers=headers, timeout=10)
         if response.status_code != 201:
             return "Failed to initiate Plex login", 500
         data = response.json()
     except Exception as e:
-        print(f"Plex login error: {e}")
+        log.warning("Plex login error: %s", plex_error(e))
         return "Failed to connect to Plex servers", 500
 
     session['plex_pin_id'] = data.get("id")
@@ -229,10 +846,10 @@ def plex_poll():
         'Accept': 'application/json'
     }
     try:
-        response = requests.get(f"https://plex.tv/api/v2/pins/{pin_id}", headers=headers, timeout=10)
+        response = plex_http.get(f"https://plex.tv/api/v2/pins/{pin_id}", headers=headers, timeout=10)
         data = response.json()
     except Exception as e:
-        print(f"Plex poll error: {e}")
+        log.warning("Plex poll error: %s", plex_error(e))
         return jsonify({'status': 'error', 'message': 'Failed to connect to Plex'})
 
     if "errors" in data:
@@ -246,7 +863,7 @@ def plex_poll():
 
         servers = []
         try:
-            server_response = requests.get("https://plex.tv/api/resources?includeHttps=1", headers={
+            server_response = plex_http.get("https://plex.tv/api/resources?includeHttps=1", headers={
                 'X-Plex-Token': auth_token,
                 'Accept': 'application/xml'
             }, timeout=10)
@@ -258,48 +875,46 @@ def plex_poll():
                 accessToken = device.attrib.get('accessToken')
                 connections = device.findall('Connection')
                 
-                # Collect all connections, preferring local
+                # Collect all connections, local first, then keep them ranked by how fast they answer
                 local_conns = [c for c in connections if c.attrib.get('local') == '1']
                 remote_conns = [c for c in connections if c.attrib.get('local') == '0']
+                candidates = [c.attrib['uri'] for c in local_conns + remote_conns if c.attrib.get('uri')]
+                ranked = rank_plex_connections(candidates)
                 
-                # Try local first, then remote
-                selected_uri = None
-                for conn in local_conns + remote_conns:
-                    uri = conn.attrib.get('uri')
-                    if uri:
-                        selected_uri = uri
-                        print(f"[MediaRoulette] Selected connection for {name}: {uri} (local={conn.attrib.get('local')})")
-                        break
-                
-                if selected_uri:
+                if ranked:
+                    log.info("Selected connection for %s: %s (%d available)", name, ranked[0], len(ranked))
+                    with _plex_routes_lock:
+                        _plex_routes[ranked[0]] = {'ranked': ranked, 'probed_at': time.time()}
                     servers.append({
                         'name': name,
-                        'uri': selected_uri,
-                        'accessToken': accessToken
+                        'uri': ranked[0],
+                        'connections': ranked,
+                        'accessToken': accessToken,
+                        'machineIdentifier': device.attrib.get('clientIdentifier')
                     })
         except Exception as e:
-            print(f"[MediaRoulette] Failed to fetch servers: {e}")
+            log.warning("Failed to fetch servers: %s", plex_error(e))
         config['plex_servers'] = servers
         if servers:
             config['plex_server_url'] = servers[0]['uri']
-            print(f"[MediaRoulette] Fetching libraries from: {servers[0]['uri']}")
+            log.info("Fetching libraries from: %s", servers[0]['uri'])
             # Fetch libraries from the first server
             try:
-                lib_response = requests.get(
-                    f"{servers[0]['uri']}/library/sections",
+                lib_response = plex_get(
+                    servers[0]['uri'], '/library/sections',
                     headers={'Accept': 'application/json'},
                     params={'X-Plex-Token': servers[0]['accessToken']},
                     timeout=15
                 )
                 if lib_response.ok:
                     config['plex_libraries'] = lib_response.json().get('MediaContainer', {}).get('Directory', [])
-                    print(f"[MediaRoulette] Found {len(config['plex_libraries'])} libraries")
+                    log.info("Found %d libraries", len(config['plex_libraries']))
                 else:
-                    print(f"[MediaRoulette] Library fetch failed with status: {lib_response.status_code}")
+                    log.warning("Library fetch failed with status: %s", lib_response.status_code)
             except requests.exceptions.Timeout:
-                print(f"[MediaRoulette] Timeout connecting to Plex server at {servers[0]['uri']}")
+                log.warning("Timeout connecting to Plex server at %s", servers[0]['uri'])
             except Exception as e:
-                print(f"[MediaRoulette] Failed to fetch libraries: {e}")
+                log.warning("Failed to fetch libraries: %s", plex_error(e))
         save_config(config)
         return jsonify({'status': 'success'})
     return jsonify({'status': 'pending'})
@@ -312,75 +927,1648 @@ def signout():
     for key in ['plex_token', 'plex_server_url', 'movies_library', 'tvshows_library', 'plex_servers']:
         config.pop(key, None)
     save_config(config)
+    clear_library_cache()
     return redirect(url_for('plex_login'))
 
-def get_machine_identifier():
-    url = f"{session.get('plex_server_url')}?X-Plex-Token={session.get('plex_token')}"
+# Plex connection manager. A server advertises several URIs (local, remote,
+# relay); the configured ``uri`` only identifies it. Each worker probes all of
+# them in parallel, sends requests through the fastest one that answered and
+# fails over down the ranking on connection errors.
+_plex_routes = {}   # configured server uri -> {'ranked': [base urls], 'probed_at': timestamp}
+_plex_routes_lock = threading.Lock()
+
+def plex_connection_candidates(server_url):
+    """Every URI the server configured as ``server_url`` advertised, configured one first"""
+    server = next((s for s in load_config().get('plex_servers', []) if s.get('uri') == server_url), None)
+    candidates = [server_url]
+    for uri in (server or {}).get('connections', []):
+        if uri not in candidates:
+            candidates.append(uri)
+    return candidates
+
+def _probe_plex_connection(base_url):
+    """Seconds a connection took to answer /identity, or None if it didn't"""
+    started = time.perf_counter()
+    try:
+        plex_http.get(f"{base_url}/identity", headers={'Accept': 'application/json'},
+                      timeout=PLEX_PROBE_TIMEOUT).raise_for_status()
+    except requests.RequestException:
+        return None
+    return time.perf_counter() - started
+
+def rank_plex_connections(candidates):
+    """Probe the candidates in parallel; reachable ones come first, fastest first"""
+    if len(candidates) <= 1:
+        return list(candidates)
+    with ThreadPoolExecutor(max_workers=len(candidates)) as probes:
+        latencies = list(probes.map(_probe_plex_connection, candidates))
+    reachable = sorted((latency, i) for i, latency in enumerate(latencies) if latency is not None)
+    ranked = [candidates[i] for _, i in reachable]
+    return ranked + [uri for uri in candidates if uri not in ranked]
+
+def probe_plex_connections(server_url, force=False):
+    """Re-rank a server's connections if they haven't been probed for PLEX_PROBE_INTERVAL"""
+    with _plex_routes_lock:
+        route = _plex_routes.get(server_url)
+    if not force and route and time.time() - route['probed_at'] < PLEX_PROBE_INTERVAL:
+        return route['ranked']
+    ranked = rank_plex_connections(plex_connection_candidates(server_url))
+    with _plex_routes_lock:
+        _plex_routes[server_url] = {'ranked': ranked, 'probed_at': time.time()}
+    if route is None or ranked[0] != route['ranked'][0]:
+        log.info("Using Plex connection %s for %s", ranked[0], server_url)
+    return ranked
+
+def plex_urls(server_url):
+    """Base URLs to try for a server, best first. Never probes; the refresher does that"""
+    with _plex_routes_lock:
+        route = _plex_routes.get(server_url)
+    return list(route['ranked']) if route else plex_connection_candidates(server_url)
+
+def demote_plex_connection(server_url, base_url):
+    with _plex_routes_lock:
+        route = _plex_routes.setdefault(server_url, {'ranked': plex_connection_candidates(server_url), 'probed_at': 0})
+        if base_url in route['ranked']:
+            route['ranked'].remove(base_url)
+            route['ranked'].append(base_url)
+
+# Per-server circuit breaker. Once PLEX_BREAKER_THRESHOLD requests in a row
+# could not reach a server (on any of its connections) or got a 5xx, the
+# circuit opens and plex_get raises PlexUnavailable straight away instead of
+# waiting out a timeout. After PLEX_BREAKER_COOLDOWN seconds a single trial
+# request is let through; its success closes the circuit.
+_plex_breakers = {}   # server uri -> {'failures': count, 'opened_at': timestamp}
+_plex_breakers_lock = threading.Lock()
+
+class PlexUnavailable(requests.ConnectionError):
+    """Raised instead of contacting a server whose circuit is open"""
+
+def plex_error(e):
+    """Describe a failed Plex request for the log without leaking the token.
+
+    The exception's own text holds the request URL, X-Plex-Token included,
+    so only the exception type and HTTP status are given.
+    """
+    if isinstance(e, PlexUnavailable):
+        return str(e)
+    response = getattr(e, 'response', None)
+    if response is not None:
+        return f"{type(e).__name__} (HTTP {response.status_code})"
+    return type(e).__name__
+
+def plex_circuit_allows(server_url):
+    with _plex_breakers_lock:
+        breaker = _plex_breakers.get(server_url)
+        if breaker is None or breaker['failures'] < PLEX_BREAKER_THRESHOLD:
+            return True
+        if time.time() - breaker['opened_at'] < PLEX_BREAKER_COOLDOWN:
+            return False
+        # Let this request through as the trial; everyone else keeps failing fast
+        breaker['opened_at'] = time.time()
+        return True
+
+def record_plex_result(server_url, ok):
+    with _plex_breakers_lock:
+        breaker = _plex_breakers.get(server_url)
+        if ok:
+            if breaker is not None:
+                del _plex_breakers[server_url]
+                if breaker['failures'] >= PLEX_BREAKER_THRESHOLD:
+                    log.info("Plex server %s is reachable again", server_url)
+            return
+        breaker = _plex_breakers.setdefault(server_url, {'failures': 0, 'opened_at': 0})
+        breaker['failures'] += 1
+        if breaker['failures'] >= PLEX_BREAKER_THRESHOLD:
+            if not breaker['opened_at']:
+                log.warning("Plex server %s failed %d requests in a row, serving cached libraries for now",
+                            server_url, breaker['failures'])
+            breaker['opened_at'] = time.time()
+
+# Single-flight. Concurrent callers fetching the same thing from Plex share
+# one upstream request: the first runs it, the others wait for its result
+# (or its exception) instead of sending an identical request.
+_inflight = {}   # key -> Future
+_inflight_lock = threading.Lock()
+
+def single_flight(key, fn, *args):
+    """Call fn(*args), or wait for the call already running under ``key``"""
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+    if not leader:
+        PLEX_SHARED_REQUESTS.inc(kind=key[0])
+        return future.result()
     try:
-        r = requests.get(url)
+        result = fn(*args)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+# Metrics label Plex endpoints with ids replaced, e.g. /library/sections/:id/all
+_NUMERIC_PATH_RE = re.compile(r"/\d+")
+
+def plex_get(server_url, path, **kwargs):
+    """GET a path from a Plex server through its fastest known connection.
+
+    A connection error or timeout demotes that connection and retries on the
+    next one, so an unreachable URI costs one timeout instead of one per call.
+    Raises PlexUnavailable without sending anything while the server's
+    circuit is open.
+    """
+    if not plex_circuit_allows(server_url):
+        PLEX_CIRCUIT_REJECTIONS.inc(server=server_url)
+        raise PlexUnavailable(f"{server_url} is unavailable, retrying in at most {PLEX_BREAKER_COOLDOWN}s")
+    endpoint = _NUMERIC_PATH_RE.sub('/:id', path) or '/'
+    urls = plex_urls(server_url)
+    for i, base_url in enumerate(urls):
+        try:
+            with PLEX_REQUEST_SECONDS.time(server=server_url, endpoint=endpoint):
+                r = plex_http.get(f"{base_url}{path}", **kwargs)
+                PLEX_RESPONSE_BYTES.observe(len(r.content), endpoint=endpoint)
+            record_plex_result(server_url, r.status_code < 500)
+            return r
+        except (requests.ConnectionError, requests.Timeout) as e:
+            PLEX_ERRORS.inc(server=server_url, endpoint=endpoint)
+            if i == len(urls) - 1:
+                record_plex_result(server_url, False)
+                raise
+            log.warning("Plex connection %s failed (%s), trying %s", base_url, e.__class__.__name__, urls[i + 1])
+            demote_plex_connection(server_url, base_url)
+
+# machineIdentifiers of servers missing one in plex_servers, and servers being looked up
+_machine_identifiers = {}
+_machine_identifier_pending = set()
+_machine_identifier_lock = threading.Lock()
+
+def get_machine_identifier(server_url, token):
+    """The machineIdentifier stored for a server, used in item deep links.
+
+    Never waits on Plex: when it isn't known yet it is looked up in the
+    background and 'unknown' is returned meanwhile.
+    """
+    server = next((s for s in load_config().get('plex_servers', []) if s.get('uri') == server_url), None)
+    machine_id = (server or {}).get('machineIdentifier') or _machine_identifiers.get(server_url)
+    if machine_id:
+        return machine_id
+    with _machine_identifier_lock:
+        if server_url in _machine_identifier_pending:
+            return 'unknown'
+        _machine_identifier_pending.add(server_url)
+    _fetch_executor.submit(resolve_machine_identifier, server_url, token)
+    return 'unknown'
+
+def resolve_machine_identifier(server_url, token):
+    """Ask a server for its machineIdentifier and store it with the server in the config"""
+    try:
+        r = plex_get(server_url, '/identity', headers={'Accept': 'application/json'},
+                     params={'X-Plex-Token': token}, timeout=10)
         r.raise_for_status()
         if 'xml' in r.headers.get('Content-Type', ''):
-            root = ElementTree.fromstring(r.text)
-            return root.attrib.get('machineIdentifier', 'unknown')
-        elif r.headers.get('Content-Type', '').startswith('application/json'):
-            return r.json().get('MediaContainer', {}).get('machineIdentifier', 'unknown')
+            machine_id = ElementTree.fromstring(r.text).attrib.get('machineIdentifier')
         else:
-            print("Unexpected response type in get_machine_identifier():", r.text[:200])
-            return 'unknown'
+            machine_id = r.json().get('MediaContainer', {}).get('machineIdentifier')
     except Exception as e:
-        print(f"Failed to get machine identifier: {e}")
-        return 'unknown'
+        log.warning("Failed to get machine identifier: %s", plex_error(e))
+        machine_id = None
+    finally:
+        with _machine_identifier_lock:
+            _machine_identifier_pending.discard(server_url)
+    if not machine_id:
+        return None
+
+    _machine_identifiers[server_url] = machine_id
+    config = load_config()
+    servers = [dict(s) for s in config.get('plex_servers', [])]
+    for server in servers:
+        if server.get('uri') == server_url:
+            server['machineIdentifier'] = machine_id
+            config['plex_servers'] = servers
+            save_config(config)
+            break
+    log.info("Resolved machine identifier for %s", server_url)
+    return machine_id
+
+def plex_item_link(server_url, machine_id, rating_key):
+    """Deep link that opens an item in Plex Web"""
+    return f"{server_url}/web/index.html#!/server/{machine_id}/details?key=%2Flibrary%2Fmetadata%2F{rating_key}"
+
+def get_plex_connection():
+    """The Plex server URL and token for this request: the session's, or the configured ones for API clients"""
+    if session.get('plex_server_url') and session.get('plex_token'):
+        return session['plex_server_url'], session['plex_token']
+    config = load_config()
+    return config.get('plex_server_url'), config.get('plex_token')
 
 def get_library_key(name):
     if not name:
         return None
-    config = load_config()
-    libs = config.get('plex_libraries', [])
-    return next((lib['key'] for lib in libs if lib['title'] == name), None)
+    return cached_table('config', _load_config)[1].get(name)
 
 def get_library_keys(names):
     """Get library keys for multiple library names"""
     if not names:
         return []
-    config = load_config()
-    libs = config.get('plex_libraries', [])
-    keys = []
-    for name in names:
-        key = next((lib['key'] for lib in libs if lib['title'] == name), None)
-        if key:
-            keys.append(key)
-    return keys
-
-def get_items_from_library(key, unwatched=False):
-    if not key:
-        return []
-    url = f"{session.get('plex_server_url')}/library/sections/{key}/all"
-    headers = {'Accept': 'application/json'}
-    params = {
-        'X-Plex-Token': session.get('plex_token'),
-        'X-Plex-Container-Start': 0,
-        'X-Plex-Container-Size': 10000  # Request up to 10k items
+    library_keys = cached_table('config', _load_config)[1]
+    return [library_keys[name] for name in names if name in library_keys]
+
+def is_item_unwatched(item):
+    # For movies: viewCount = 0 or missing means unwatched
+    # For shows: viewedLeafCount = 0 or missing means fully unwatched
+    if item.get('type') == 'show':
+        return item.get('viewedLeafCount', 0) == 0
+    return item.get('viewCount', 0) == 0
+
+# Process-wide cache of synced sections, keyed by (server URL, section key).
+# Each entry holds the section's items plus the sync watermark. Entries are evicted least-recently-used
+# once LIBRARY_CACHE_MAX_ENTRIES is reached.
+_library_cache = OrderedDict()
+_library_cache_lock = threading.Lock()
+
+def _library_cache_path(cache_key):
+    digest = hashlib.sha1(json.dumps(cache_key).encode()).hexdigest()
+    return os.path.join(LIBRARY_CACHE_DIR, f"{digest}.snap")
+
+# Library snapshots. With LIBRARY_CACHE_DISK each synced section is written
+# once to data/library_cache/ and every worker memory-maps the file
+# read-only, so the items, the filter columns and the keyword index sit in
+# the shared page cache instead of being parsed into each worker. Layout:
+#
+#   magic | header length (uint32 LE) | JSON header | columns, 8-byte aligned
+#
+# The header holds the sync metadata and each column's typecode, offset and
+# size. Numeric columns are arrays in native byte order; items are compact
+# JSON records decoded only when a spin picks them. A snapshot is replaced
+# with os.replace, so a worker keeps reading the old file until it maps the
+# new one, and its mtime is when the section was last confirmed current.
+# After an incremental sync the unchanged parts of the previous snapshot are
+# copied as they are, so only the changed items are encoded and tokenized.
+SNAPSHOT_MAGIC = b'MRSNAP2\n'
+SNAPSHOT_ARRAY_COLUMNS = ('types', 'years', 'release_ordinals', 'audience_ratings', 'view_counts',
+                          'unwatched', 'content_rating_ids', 'updated_ats', 'last_viewed_ats',
+                          'genre_offsets', 'genre_ids')
+
+def _align(size):
+    return -(-size // 8) * 8
+
+def section_columns(items):
+    """Filter columns for one section's items, as stored in snapshots and merged by LibraryIndex"""
+    if isinstance(items, SnapshotItems):
+        return items.columns
+    columns = {
+        'rating_keys': [],
+        'types': array('b'),              # 1 for shows, 0 for everything else
+        'years': array('H'),              # 0 when unknown
+        'release_ordinals': array('I'),   # date.toordinal() of originallyAvailableAt, 0 when unknown
+        'audience_ratings': array('d'),   # 0.0 when missing
+        'view_counts': array('I'),        # viewCount for movies, viewedLeafCount for shows
+        'unwatched': array('b'),
+        'content_rating_ids': array('H'),
+        'content_ratings': [],            # content rating id -> name
+        'updated_ats': array('q'),        # updatedAt and lastViewedAt, compared by incremental syncs
+        'last_viewed_ats': array('q'),
+        'genre_offsets': array('I', [0]), # item i's genre ids are genre_ids[genre_offsets[i]:genre_offsets[i + 1]]
+        'genre_ids': array('H'),
+        'genre_names': [],                # genre id -> tag
     }
-    if unwatched:
-        params['unwatched'] = 1
+    content_rating_lookup = {}
+    genre_lookup = {}
+    for item in items:
+        columns['rating_keys'].append(item.get('ratingKey'))
+        is_show = item.get('type') == 'show'
+        columns['types'].append(1 if is_show else 0)
+        columns['years'].append(item.get('year') or 0)
+        try:
+            released = datetime.strptime(item.get('originallyAvailableAt') or '', "%Y-%m-%d").toordinal()
+        except ValueError:
+            released = 0
+        columns['release_ordinals'].append(released)
+        try:
+            score = float(item.get('audienceRating') or 0)
+        except (TypeError, ValueError):
+            score = 0.0
+        columns['audience_ratings'].append(score)
+        columns['view_counts'].append(item.get('viewedLeafCount' if is_show else 'viewCount', 0) or 0)
+        columns['unwatched'].append(1 if is_item_unwatched(item) else 0)
+        columns['updated_ats'].append(item.get('updatedAt') or 0)
+        columns['last_viewed_ats'].append(item.get('lastViewedAt') or 0)
+
+        content_rating = item.get('contentRating')
+        if content_rating not in content_rating_lookup:
+            content_rating_lookup[content_rating] = len(columns['content_ratings'])
+            columns['content_ratings'].append(content_rating)
+        columns['content_rating_ids'].append(content_rating_lookup[content_rating])
+
+        for g in item.get('Genre', []):
+            if g['tag'] not in genre_lookup:
+                genre_lookup[g['tag']] = len(columns['genre_names'])
+                columns['genre_names'].append(g['tag'])
+            columns['genre_ids'].append(genre_lookup[g['tag']])
+        columns['genre_offsets'].append(len(columns['genre_ids']))
+    return columns
+
+def item_terms(item):
+    """The distinct words of an item's title and summary, as the keyword index stores them"""
+    return set(tokenize(f"{item.get('title') or ''} {item.get('summary') or ''}"))
+
+def build_postings(items):
+    """Sorted title and summary words, with the positions of the items containing each"""
+    postings = {}
+    for position, item in enumerate(items):
+        for term in item_terms(item):
+            positions = postings.get(term)
+            if positions is None:
+                positions = postings[term] = array('I')
+            positions.append(position)
+    terms = sorted(postings)
+    offsets = array('I', [0])
+    flat = array('I')
+    for term in terms:
+        flat.extend(postings[term])
+        offsets.append(len(flat))
+    return terms, offsets, flat
+
+def write_library_snapshot(path, state):
+    """Write a section's state to a snapshot file, atomically replacing the previous one"""
+    items = state['items']
+    if isinstance(items, PatchedItems):
+        columns, record_offsets, records, (terms, posting_offsets, postings) = patch_snapshot_blobs(items)
+    else:
+        columns = section_columns(items)
+        records = bytearray()
+        record_offsets = array('Q', [0])
+        for item in items:
+            records += encode_record(item)
+            record_offsets.append(len(records))
+        terms, posting_offsets, postings = build_postings(items)
+    blobs = {name: columns[name] for name in SNAPSHOT_ARRAY_COLUMNS}
+    blobs.update(rating_keys='\n'.join(columns['rating_keys']).encode(), record_offsets=record_offsets,
+                 records=records, terms='\n'.join(terms).encode(), posting_offsets=posting_offsets,
+                 postings=postings)
+
+    layout = {}
+    offset = 0
+    for name, blob in blobs.items():
+        size = memoryview(blob).nbytes
+        layout[name] = (blob.typecode if isinstance(blob, array) else 'B', offset, size)
+        offset += _align(size)
+    header = json.dumps({
+        'watermark': state['watermark'], 'full_sync_at': state['full_sync_at'], 'generation': state['generation'],
+        'byteorder': sys.byteorder, 'content_ratings': columns['content_ratings'],
+        'genre_names': columns['genre_names'], 'columns': layout
+    }).encode()
+    preamble = SNAPSHOT_MAGIC + len(header).to_bytes(4, 'little') + header
+
+    # Unique per thread as well as per worker, so overlapping syncs never share a temp file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
     try:
-        r = requests.get(url, headers=headers, params=params, timeout=30)
+        with open(tmp_path, 'wb') as f:
+            f.write(preamble.ljust(_align(len(preamble)), b'\0'))
+            for blob in blobs.values():
+                f.write(blob)
+                f.write(bytes(_align(memoryview(blob).nbytes) - memoryview(blob).nbytes))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+class SnapshotItems(Sequence):
+    """A section's items, decoded on access from a memory-mapped snapshot"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mtime = os.fstat(f.fileno()).st_mtime
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a library snapshot")
+        header_start = len(SNAPSHOT_MAGIC) + 4
+        header_size = int.from_bytes(self._map[len(SNAPSHOT_MAGIC):header_start], 'little')
+        self.header = json.loads(self._map[header_start:header_start + header_size])
+        if self.header['byteorder'] != sys.byteorder:
+            raise ValueError(f"{path} was written on a machine with a different byte order")
+        self._data_start = _align(header_start + header_size)
+        view = memoryview(self._map)
+        self._views = {name: view[self._data_start + offset:self._data_start + offset + size].cast(typecode)
+                       for name, (typecode, offset, size) in self.header['columns'].items()}
+        self._record_offsets = self._views['record_offsets']
+        self._records_start = self._data_start + self.header['columns']['records'][1]
+        self._columns = None
+        self.text_index = SnapshotTextIndex(self)
+
+    def __len__(self):
+        return len(self._record_offsets) - 1
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        start = self._records_start + self._record_offsets[i]
+        return json.loads(self._map[start:self._records_start + self._record_offsets[i + 1]])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def strings(self, name):
+        """A newline-separated string column as a list"""
+        _, offset, size = self.header['columns'][name]
+        start = self._data_start + offset
+        return self._map[start:start + size].decode().split('\n') if size else []
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            columns = {name: self._views[name] for name in SNAPSHOT_ARRAY_COLUMNS}
+            columns.update(rating_keys=self.strings('rating_keys'), content_ratings=self.header['content_ratings'],
+                           genre_names=self.header['genre_names'])
+            self._columns = columns
+        return self._columns
+
+class PatchedItems(Sequence):
+    """A snapshot's items with some replaced or appended by an incremental sync.
+
+    Only the changed items are held in memory; write_library_snapshot copies
+    the rest straight from the base snapshot.
+    """
+
+    def __init__(self, base, replaced, added):
+        self.base = base            # SnapshotItems
+        self.replaced = replaced    # position -> item
+        self.added = added
+
+    def __len__(self):
+        return len(self.base) + len(self.added)
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        if i in self.replaced:
+            return self.replaced[i]
+        if i < len(self.base):
+            return self.base[i]
+        return self.added[i - len(self.base)]
+
+def encode_record(item):
+    return json.dumps(item, separators=(',', ':')).encode()
+
+def _splice_ragged(offsets, values, offset_typecode, typecode, replaced, added):
+    """Rebuild a variable-length column with some items replaced and others appended.
+
+    Item i's values are values[offsets[i]:offsets[i + 1]]; the runs of
+    unchanged items between replaced ones are copied in bulk.
+    """
+    new_offsets = array(offset_typecode, [0])
+    new_values = array(typecode)
+    start = 0
+    for position in sorted(replaced) + [len(offsets) - 1]:
+        shift = len(new_values) - offsets[start]
+        new_values.frombytes(values[offsets[start]:offsets[position]].cast('B'))
+        new_offsets.extend(offset + shift for offset in offsets[start + 1:position + 1])
+        if position in replaced:
+            new_values.frombytes(memoryview(replaced[position]).cast('B'))
+            new_offsets.append(len(new_values))
+        start = position + 1
+    for item_values in added:
+        new_values.frombytes(memoryview(item_values).cast('B'))
+        new_offsets.append(len(new_values))
+    return new_offsets, new_values
+
+def _drop_unused_names(names, ids):
+    """Drop lookup names no item refers to any more, renumbering the ids"""
+    used = sorted(set(ids))
+    if len(used) == len(names):
+        return names, ids
+    renumbered = {old_id: new_id for new_id, old_id in enumerate(used)}
+    return [names[i] for i in used], array(ids.typecode, (renumbered[i] for i in ids))
+
+def patch_snapshot_blobs(items):
+    """Columns, records and keyword postings for a PatchedItems, reusing its base snapshot's"""
+    base = items.base
+    old = base.columns
+    positions = sorted(items.replaced)
+    delta = section_columns([items.replaced[p] for p in positions] + items.added)
+    replaced_count = len(positions)
+
+    # The changed items' lookup ids are their own; move them onto the base's
+    lookups = {}
+    for names_column, ids_column in (('content_ratings', 'content_rating_ids'), ('genre_names', 'genre_ids')):
+        names = list(old[names_column])
+        lookup = {name: i for i, name in enumerate(names)}
+        for name in delta[names_column]:
+            if name not in lookup:
+                lookup[name] = len(names)
+                names.append(name)
+        ids = [lookup[name] for name in delta[names_column]]
+        delta[ids_column] = array(delta[ids_column].typecode, (ids[i] for i in delta[ids_column]))
+        lookups[names_column] = names
+
+    columns = {'rating_keys': old['rating_keys'] + delta['rating_keys'][replaced_count:]}
+    for name in SNAPSHOT_ARRAY_COLUMNS:
+        if name in ('genre_offsets', 'genre_ids'):
+            continue
+        column = array(delta[name].typecode)
+        column.frombytes(old[name].cast('B'))
+        for j, position in enumerate(positions):
+            column[position] = delta[name][j]
+        column.extend(delta[name][replaced_count:])
+        columns[name] = column
+    genre_offsets, genre_ids = delta['genre_offsets'], delta['genre_ids']
+    genres = [genre_ids[genre_offsets[j]:genre_offsets[j + 1]] for j in range(len(genre_offsets) - 1)]
+    columns['genre_offsets'], columns['genre_ids'] = _splice_ragged(
+        old['genre_offsets'], old['genre_ids'], 'I', 'H', dict(zip(positions, genres)), genres[replaced_count:])
+    columns['content_ratings'], columns['content_rating_ids'] = _drop_unused_names(
+        lookups['content_ratings'], columns['content_rating_ids'])
+    columns['genre_names'], columns['genre_ids'] = _drop_unused_names(lookups['genre_names'], columns['genre_ids'])
+
+    record_offsets, records = _splice_ragged(
+        base._views['record_offsets'], base._views['records'], 'Q', 'B',
+        {p: encode_record(items.replaced[p]) for p in positions}, [encode_record(item) for item in items.added])
+
+    # Only the changed items' words move in the keyword index
+    removed, inserted = {}, {}
+    for position in positions:
+        for term in item_terms(base[position]):
+            removed.setdefault(term, set()).add(position)
+        for term in item_terms(items.replaced[position]):
+            inserted.setdefault(term, set()).add(position)
+    for position, item in enumerate(items.added, len(base)):
+        for term in item_terms(item):
+            inserted.setdefault(term, set()).add(position)
+    old_terms = base.strings('terms')
+    old_term_ids = {term: i for i, term in enumerate(old_terms)}
+    old_offsets, old_postings = base._views['posting_offsets'], base._views['postings']
+    terms = []
+    posting_offsets = array('I', [0])
+    postings = array('I')
+    for term in sorted(old_terms + [term for term in inserted if term not in old_term_ids]):
+        i = old_term_ids.get(term)
+        start, end = (old_offsets[i], old_offsets[i + 1]) if i is not None else (0, 0)
+        term_removed, term_inserted = removed.get(term, ()), inserted.get(term, ())
+        # Walk the changed positions through the old list, copying the runs between them
+        for position in sorted(set(term_removed) | set(term_inserted)):
+            found = bisect_left(old_postings, position, start, end)
+            postings.frombytes(old_postings[start:found].cast('B'))
+            start = found + 1 if found < end and old_postings[found] == position else found
+            if position in term_inserted:
+                postings.append(position)
+        postings.frombytes(old_postings[start:end].cast('B'))
+        if len(postings) == posting_offsets[-1]:
+            continue
+        terms.append(term)
+        posting_offsets.append(len(postings))
+    return columns, record_offsets, records, (terms, posting_offsets, postings)
+
+class SnapshotTextIndex:
+    """The keyword index stored in a snapshot; searches like TextIndex but is read-only"""
+
+    __slots__ = ('snapshot', '_vocabulary')
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._vocabulary = None
+
+    def search(self, query):
+        """Return ratingKeys containing every query word, each matched as a word prefix"""
+        words = tokenize(query)
+        if not words:
+            return set()
+        if self._vocabulary is None:
+            self._vocabulary = self.snapshot.strings('terms')
+        offsets = self.snapshot._views['posting_offsets']
+        postings = self.snapshot._views['postings']
+        result = None
+        for word in words:
+            start = bisect_left(self._vocabulary, word)
+            end = bisect_left(self._vocabulary, word + '\U0010ffff', start)
+            positions = set(postings[offsets[start]:offsets[end]])
+            result = positions if result is None else result & positions
+            if not result:
+                break
+        rating_keys = self.snapshot.columns['rating_keys']
+        return {rating_keys[position] for position in result}
+
+def read_library_snapshot(path):
+    """Map a snapshot file and return the section state it holds"""
+    items = SnapshotItems(path)
+    header = items.header
+    return {'items': items, 'text_index': items.text_index, 'watermark': header['watermark'],
+            'synced_at': items.mtime, 'full_sync_at': header['full_sync_at'], 'generation': header['generation'],
+            'snapshot_mtime': items.mtime}
+
+def library_cache_get(cache_key):
+    """Return the newest known state for a section (possibly stale), or None"""
+    with _library_cache_lock:
+        state = _library_cache.get(cache_key)
+        if state:
+            _library_cache.move_to_end(cache_key)
+
+    # Another worker (or a webhook it received) may have synced newer content
+    # or confirmed the current content. Either changes the mtime, so a stat is enough.
+    if LIBRARY_CACHE_DISK:
+        path = _library_cache_path(cache_key)
+        try:
+            mtime = os.path.getmtime(path)
+            if not state or mtime > state.get('snapshot_mtime', 0):
+                with STORAGE_SECONDS.time(operation='snapshot_read'):
+                    snapshot = read_library_snapshot(path)
+                if not state or (snapshot['synced_at'] > state['synced_at'] and snapshot['generation'] != state['generation']):
+                    state = snapshot
+                    _library_cache_store(cache_key, state)
+                else:
+                    state['synced_at'] = max(state['synced_at'], snapshot['synced_at'])
+                    state['snapshot_mtime'] = snapshot['snapshot_mtime']
+        except (OSError, ValueError, KeyError):
+            pass
+    return state
+
+def _library_cache_store(cache_key, state):
+    with _library_cache_lock:
+        _library_cache[cache_key] = state
+        _library_cache.move_to_end(cache_key)
+        while len(_library_cache) > LIBRARY_CACHE_MAX_ENTRIES:
+            _library_cache.popitem(last=False)
+
+def library_cache_put(cache_key, state):
+    """Cache a newly synced section and return the state to use from now on.
+
+    With LIBRARY_CACHE_DISK that is the written snapshot, so the fetched
+    items can be freed and this worker shares the mapping with the others.
+    """
+    if LIBRARY_CACHE_DISK:
+        path = _library_cache_path(cache_key)
+        try:
+            with STORAGE_SECONDS.time(operation='snapshot_write'):
+                write_library_snapshot(path, state)
+            with STORAGE_SECONDS.time(operation='snapshot_read'):
+                state = read_library_snapshot(path)
+        except (OSError, ValueError) as e:
+            log.error("Failed to write library snapshot: %s", e)
+    _library_cache_store(cache_key, state)
+    return state
+
+def library_cache_confirm(cache_key, state):
+    """Record that a sync found no changes, so other workers skip their own sync"""
+    _library_cache_store(cache_key, state)
+    if LIBRARY_CACHE_DISK:
+        path = _library_cache_path(cache_key)
+        try:
+            os.utime(path)
+            state['synced_at'] = state['snapshot_mtime'] = os.path.getmtime(path)
+        except OSError:
+            pass
+
+class library_sync_lock:
+    """Held by the worker syncing a section, so workers never fetch the same section from Plex at once.
+
+    Waits by polling rather than blocking, so a gevent worker keeps serving
+    other requests while another worker finishes the sync.
+    """
+
+    def __init__(self, cache_key):
+        self.path = _library_cache_path(cache_key) + '.lock'
+        self.file = None
+
+    def __enter__(self):
+        if not LIBRARY_CACHE_DISK or fcntl is None:
+            return self
+        self.file = open(self.path, 'a')
+        while True:
+            try:
+                fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return self
+            except BlockingIOError:
+                time.sleep(0.1)
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+        return False
+
+def clear_library_cache(server_url=None, section_keys=()):
+    """Drop cached sections, in memory and on disk: all of them, or the given sections of one server"""
+    with _library_cache_lock:
+        for cache_key in list(_library_cache):
+            if server_url is None or cache_key[0] == server_url:
+                del _library_cache[cache_key]
+    if server_url is not None:
+        for key in section_keys:
+            try:
+                os.remove(_library_cache_path((server_url, str(key))))
+            except OSError:
+                pass
+        return
+    for name in os.listdir(LIBRARY_CACHE_DIR):
+        # .json snapshots were written by older versions
+        if name.endswith(('.snap', '.json')):
+            try:
+                os.remove(os.path.join(LIBRARY_CACHE_DIR, name))
+            except OSError:
+                pass
+
+# The only item fields the filters and build_item_data read. Everything else
+# Plex sends (Media, Role, Director, guids, ...) is dropped as pages arrive.
+LIBRARY_ITEM_FIELDS = (
+    'ratingKey', 'type', 'title', 'year', 'summary', 'thumb', 'contentRating',
+    'duration', 'audienceRating', 'audienceRatingImage', 'originallyAvailableAt',
+    'viewCount', 'viewedLeafCount', 'addedAt', 'updatedAt', 'lastViewedAt'
+)
+
+def slim_item(item):
+    slim = {field: item[field] for field in LIBRARY_ITEM_FIELDS if field in item}
+    if 'Genre' in item:
+        slim['Genre'] = [{'tag': g['tag']} for g in item['Genre']]
+    return slim
+
+def iter_library_items(server_url, token, key, filters=None, page_size=LIBRARY_PAGE_SIZE):
+    """Yield a section's items page by page, keeping only the fields we use"""
+    path = f"/library/sections/{key}/all"
+    headers = {'Accept': 'application/json'}
+    start = 0
+    while True:
+        params = {
+            'X-Plex-Token': token,
+            'X-Plex-Container-Start': start,
+            'X-Plex-Container-Size': page_size
+        }
+        params.update(filters or {})
+        r = plex_get(server_url, path, headers=headers, params=params, timeout=30)
         r.raise_for_status()
-        items = r.json().get('MediaContainer', {}).get('Metadata', [])
-        print(f"Library {key}: fetched {len(items)} items (unwatched={unwatched})")
-        return items
-    except Exception as e:
-        print(f"Failed to fetch library {key}: {e}")
+        container = r.json().get('MediaContainer', {})
+        page = container.get('Metadata', [])
+        del r  # Release the raw page body before handing out items
+        for item in page:
+            yield slim_item(item)
+        start += len(page)
+        total_size = int(container.get('totalSize', 0))
+        if len(page) < page_size or (total_size and start >= total_size):
+            break
+
+def fetch_library_items(server_url, token, key, filters=None):
+    """All of a section's items (matching ``filters``); identical concurrent fetches share one walk"""
+    flight_key = ('items', server_url, token, str(key), tuple(sorted((filters or {}).items())))
+    return single_flight(flight_key, _fetch_library_items, server_url, token, key, filters)
+
+def _fetch_library_items(server_url, token, key, filters):
+    # Pages can shift if the library changes mid-walk, so drop duplicates
+    items = {}
+    for item in iter_library_items(server_url, token, key, filters):
+        items[item.get('ratingKey')] = item
+    return list(items.values())
+
+def fetch_library_size(server_url, token, key, filters=None):
+    """Ask Plex how many items a section holds (or match ``filters``) without transferring any of them"""
+    flight_key = ('size', server_url, token, str(key), tuple(sorted((filters or {}).items())))
+    return single_flight(flight_key, _fetch_library_size, server_url, token, key, filters)
+
+def _fetch_library_size(server_url, token, key, filters):
+    params = {'X-Plex-Token': token, 'X-Plex-Container-Start': 0, 'X-Plex-Container-Size': 0}
+    params.update(filters or {})
+    r = plex_get(
+        server_url, f"/library/sections/{key}/all",
+        headers={'Accept': 'application/json'},
+        params=params,
+        timeout=15
+    )
+    r.raise_for_status()
+    container = r.json().get('MediaContainer', {})
+    return int(container.get('totalSize', container.get('size', 0)))
+
+# Item timestamps compared against the sync watermark. Anything added, edited
+# or watched since the last sync has at least one of these past the watermark.
+SYNC_WATERMARK_FIELDS = ('addedAt', 'updatedAt', 'lastViewedAt')
+
+def _items_watermark(items):
+    return max((item.get(field) or 0 for item in items for field in SYNC_WATERMARK_FIELDS), default=0)
+
+def _build_section_state(items, full_sync_at, watermark=None):
+    if watermark is None:
+        watermark = _items_watermark(items)
+    now = time.time()
+    # The generation only changes when the content does, so anything derived
+    # from a section (like the spin index) can be reused across no-op syncs
+    return {'items': items, 'watermark': watermark, 'synced_at': now,
+            'full_sync_at': full_sync_at or now, 'generation': time.time_ns()}
+
+def sync_library_section(server_url, token, key, state=None):
+    """Bring a section's local copy up to date, fetching only what changed when possible"""
+    started = time.perf_counter()
+    if state is None or time.time() - state['full_sync_at'] >= LIBRARY_FULL_SYNC_INTERVAL:
+        items = fetch_library_items(server_url, token, key)
+        LIBRARY_SYNC_SECONDS.observe(time.perf_counter() - started, kind='full')
+        log.info("Library %s: full sync fetched %d items", key, len(items))
+        return _build_section_state(items, None)
+
+    deltas = {}
+    for field in SYNC_WATERMARK_FIELDS:
+        # '>>=' is Plex's strict greater-than; step back a second so items
+        # touched in the same second as the last sync are not missed
+        for item in fetch_library_items(server_url, token, key, {f"{field}>>": state['watermark'] - 1}):
+            deltas[item.get('ratingKey')] = item
+
+    items = state['items']
+    if isinstance(items, SnapshotItems):
+        # Compare against the snapshot's columns: an item whose updatedAt and
+        # lastViewedAt are unchanged was neither edited nor watched, so only
+        # the records of changed items are ever decoded
+        columns = items.columns
+        positions = {rating_key: i for i, rating_key in enumerate(columns['rating_keys'])}
+        replaced, added = {}, []
+        for rating_key, item in deltas.items():
+            i = positions.get(rating_key)
+            if i is None:
+                added.append(item)
+            elif ((item.get('updatedAt') or 0, item.get('lastViewedAt') or 0)
+                  != (columns['updated_ats'][i], columns['last_viewed_ats'][i]) and items[i] != item):
+                replaced[i] = item
+        changed = list(replaced.values()) + added
+        local_size = len(items) + len(added)
+    else:
+        by_key = {item.get('ratingKey'): item for item in items}
+        changed = []
+        for rating_key, item in deltas.items():
+            if by_key.get(rating_key) != item:
+                by_key[rating_key] = item
+                changed.append(item)
+        local_size = len(by_key)
+
+    # Deltas never report deletions. If the counts disagree something was
+    # removed, so fall back to a full refetch to reconcile.
+    total_size = fetch_library_size(server_url, token, key)
+    if total_size != local_size:
+        items = fetch_library_items(server_url, token, key)
+        LIBRARY_SYNC_SECONDS.observe(time.perf_counter() - started, kind='reconcile')
+        log.info("Library %s: size mismatch (%d local vs %d on server), refetched %d items",
+                 key, local_size, total_size, len(items))
+        return _build_section_state(items, None)
+
+    LIBRARY_SYNC_SECONDS.observe(time.perf_counter() - started, kind='incremental')
+    if not changed:
+        return dict(state, synced_at=time.time())
+    log.info("Library %s: incremental sync merged %d updated items", key, len(changed))
+    watermark = max(state['watermark'], _items_watermark(changed))
+    if isinstance(items, SnapshotItems):
+        return _build_section_state(PatchedItems(items, replaced, added), state['full_sync_at'], watermark)
+    new_state = _build_section_state(list(by_key.values()), state['full_sync_at'], watermark)
+    # A section read from a snapshot gets a new keyword index with its next snapshot
+    if isinstance(state.get('text_index'), TextIndex):
+        state['text_index'].update(changed)
+        new_state['text_index'] = state['text_index']
+    return new_state
+
+def refresh_library_section(server_url, token, key, force=False):
+    """Sync a section now unless it is still fresh; raises if Plex can't be reached.
+
+    Requests and the refresher asking for the same section at once share one sync.
+    """
+    return single_flight(('section', server_url, str(key), force), _refresh_library_section,
+                         server_url, token, key, force)
+
+def _refresh_library_section(server_url, token, key, force):
+    cache_key = (server_url, str(key))
+    state = library_cache_get(cache_key)
+    if not force and state is not None and time.time() - state['synced_at'] < LIBRARY_CACHE_TTL:
+        return state
+    with library_sync_lock(cache_key):
+        # Another worker may have synced the section while this one waited
+        state = library_cache_get(cache_key)
+        if not force and state is not None and time.time() - state['synced_at'] < LIBRARY_CACHE_TTL:
+            return state
+        new_state = sync_library_section(server_url, token, key, state)
+        if state is not None and new_state['generation'] == state['generation']:
+            # Nothing changed, so there is no need to rewrite the shared snapshot
+            library_cache_confirm(cache_key, new_state)
+            return new_state
+        return library_cache_put(cache_key, new_state)
+
+def get_library_state(key, server_url, token, wait=True):
+    """Return the synced state for a section without waiting on Plex when anything is cached.
+
+    Stale sections are served as-is and handed to the background refresher.
+    Only a section that has never been synced is fetched inline, and only
+    when ``wait`` is set; otherwise it is scheduled and None is returned.
+    """
+    state = library_cache_get((server_url, str(key)))
+    if state is None:
+        CACHE_REQUESTS.inc(cache='library_section', result='miss')
+        if not wait:
+            schedule_library_refresh(server_url, token, key)
+            return None
+        try:
+            return refresh_library_section(server_url, token, key)
+        except Exception as e:
+            log.error("Failed to fetch library %s: %s", key, plex_error(e))
+            return None
+    if time.time() - state['synced_at'] >= LIBRARY_CACHE_TTL:
+        CACHE_REQUESTS.inc(cache='library_section', result='stale')
+        schedule_library_refresh(server_url, token, key)
+    else:
+        CACHE_REQUESTS.inc(cache='library_section', result='hit')
+    return state
+
+def get_library_states(keys, server_url, token, wait=True):
+    """Sync several sections concurrently; sections that failed with nothing cached are None"""
+    if len(keys) <= 1 or not wait:
+        return [get_library_state(key, server_url, token, wait) for key in keys]
+    futures = [_fetch_executor.submit(get_library_state, key, server_url, token) for key in keys]
+    return [future.result() for future in futures]
+
+# Background refresher. Each worker runs one daemon thread that re-syncs the
+# configured sections every LIBRARY_REFRESH_INTERVAL seconds (with jitter),
+# plus any section a request found stale or a Plex webhook reported changed.
+_refresh_pending = {}   # (server_url, section key) -> (token, force)
+_refresh_cond = threading.Condition()
+_refresher_thread = None
+
+def schedule_library_refresh(server_url, token, key, force=False):
+    with _refresh_cond:
+        cache_key = (server_url, str(key))
+        _, already_forced = _refresh_pending.get(cache_key, (None, False))
+        _refresh_pending[cache_key] = (token, force or already_forced)
+        _refresh_cond.notify()
+    start_library_refresher()
+
+def start_library_refresher():
+    global _refresher_thread
+    with _refresh_cond:
+        if _refresher_thread is None or not _refresher_thread.is_alive():
+            _refresher_thread = threading.Thread(target=_library_refresher, name='library-refresher', daemon=True)
+            _refresher_thread.start()
+
+def get_configured_libraries(config):
+    """Return the (movie, TV show) library names selected in settings"""
+    # Support both old single-value and new multi-value config
+    movies_libraries = config.get('movies_libraries', [])
+    tvshows_libraries = config.get('tvshows_libraries', [])
+
+    # Backward compatibility: if no arrays but old single values exist, use those
+    if not movies_libraries and config.get('movies_library'):
+        movies_libraries = [config.get('movies_library')]
+    if not tvshows_libraries and config.get('tvshows_library'):
+        tvshows_libraries = [config.get('tvshows_library')]
+    return movies_libraries, tvshows_libraries
+
+def _configured_sections():
+    config = load_config()
+    if not config.get('plex_server_url') or not config.get('plex_token'):
         return []
+    movies_libraries, tvshows_libraries = get_configured_libraries(config)
+    keys = get_library_keys(movies_libraries + tvshows_libraries)
+    return [(config['plex_server_url'], config['plex_token'], key) for key in keys]
 
-def extract_genres(items):
-    genres = set()
-    for item in items:
-        for g in item.get('Genre', []):
-            genres.add(g['tag'])
-    return sorted(genres)
+def _library_refresher():
+    failures = 0
+    next_scheduled = time.time()  # Warm the cache as soon as the worker starts
+    while True:
+        with _refresh_cond:
+            if not _refresh_pending:
+                _refresh_cond.wait(max(0, next_scheduled - time.time()))
+            pending = dict(_refresh_pending)
+            _refresh_pending.clear()
+
+        scheduled_run = time.time() >= next_scheduled
+        if scheduled_run:
+            try:
+                sections = _configured_sections()
+                for server_url, token in {(server_url, token) for server_url, token, _ in sections}:
+                    probe_plex_connections(server_url)
+                    get_machine_identifier(server_url, token)
+                for server_url, token, key in sections:
+                    pending.setdefault((server_url, str(key)), (token, False))
+            except Exception as e:
+                log.error("Refresher could not read config: %s", plex_error(e))
+
+        slow_or_failed = False
+        for (server_url, key), (token, force) in pending.items():
+            started = time.time()
+            try:
+                refresh_library_section(server_url, token, key, force=force)
+            except Exception as e:
+                log.warning("Background refresh of library %s failed: %s", key, plex_error(e))
+                slow_or_failed = True
+                continue
+            if time.time() - started > LIBRARY_REFRESH_SLOW_SECONDS:
+                slow_or_failed = True
+
+        if scheduled_run:
+            # Back off exponentially while Plex is failing or slow; jitter keeps
+            # workers from refreshing in lockstep
+            failures = failures + 1 if slow_or_failed else 0
+            delay = min(LIBRARY_REFRESH_INTERVAL * (2 ** failures), LIBRARY_REFRESH_MAX_BACKOFF)
+            next_scheduled = time.time() + delay * random.uniform(0.9, 1.1)
+
+@app.before_request
+def ensure_library_refresher():
+    # Started lazily so each gunicorn worker gets its own thread after forking
+    start_library_refresher()
+
+@app.after_request
+def share_metrics(response):
+    flush_metrics()
+    return response
+
+_WORD_RE = re.compile(r"\w+")
+
+def tokenize(text):
+    return _WORD_RE.findall(text.lower())
+
+class TextIndex:
+    """Inverted index from title and summary words to ratingKeys for one section.
+
+    Kept alongside the section's synced state and updated in place as
+    incremental syncs bring in changed items, so it is never rebuilt from
+    scratch unless the section is fully refetched.
+    """
+
+    __slots__ = ('postings', 'doc_terms', '_vocabulary', '_lock')
+
+    def __init__(self, items=()):
+        self.postings = {}     # term -> set of ratingKeys
+        self.doc_terms = {}    # ratingKey -> terms, so an item can be re-indexed
+        self._vocabulary = None  # sorted terms for prefix lookups, rebuilt lazily
+        self._lock = threading.Lock()
+        self.update(items)
+
+    def update(self, items):
+        with self._lock:
+            for item in items:
+                rating_key = item.get('ratingKey')
+                self._remove(rating_key)
+                terms = frozenset(tokenize(f"{item.get('title') or ''} {item.get('summary') or ''}"))
+                self.doc_terms[rating_key] = terms
+                for term in terms:
+                    if term not in self.postings:
+                        self.postings[term] = set()
+                        self._vocabulary = None
+                    self.postings[term].add(rating_key)
+
+    def _remove(self, rating_key):
+        for term in self.doc_terms.pop(rating_key, ()):
+            keys = self.postings[term]
+            keys.discard(rating_key)
+            if not keys:
+                del self.postings[term]
+                self._vocabulary = None
+
+    def search(self, query):
+        """Return ratingKeys containing every query word, each matched as a word prefix"""
+        words = tokenize(query)
+        if not words:
+            return set()
+        with self._lock:
+            if self._vocabulary is None:
+                self._vocabulary = sorted(self.postings)
+            result = None
+            for word in words:
+                start = bisect_left(self._vocabulary, word)
+                end = bisect_left(self._vocabulary, word + '\U0010ffff', start)
+                keys = set().union(*(self.postings[term] for term in self._vocabulary[start:end]))
+                result = keys if result is None else result & keys
+                if not result:
+                    break
+            return result
+
+class ChainedItems(Sequence):
+    """Several sections' item sequences addressed by one position"""
+
+    __slots__ = ('parts', 'starts', 'length')
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.starts = []
+        self.length = 0
+        for part in parts:
+            self.starts.append(self.length)
+            self.length += len(part)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.length:
+            raise IndexError(i)
+        part = bisect_right(self.starts, i) - 1
+        return self.parts[part][i - self.starts[part]]
+
+class LibraryIndex:
+    """Column store over one snapshot of the configured sections.
+
+    Built once per snapshot so a spin is a handful of set intersections and
+    bisects instead of re-parsing dates, ratings and genre tags per item.
+    Item ids are positions in ``items``.
+    """
+
+    __slots__ = ('items', 'rating_keys', 'types', 'years', 'release_ordinals', 'audience_ratings',
+                 'content_rating_ids', 'content_ratings', 'view_counts', 'genres', 'text_indexes',
+                 'ids_by_rating_key', 'by_section', 'by_genre', 'by_content_rating', 'unwatched',
+                 'snapshot', '_release_order', '_release_sorted', '_score_order', '_score_sorted')
+
+    def __init__(self, sections, snapshot=None):
+        """sections is a list of (section key, items, text index) tuples"""
+        self.snapshot = snapshot             # identifies the section generations this was built from
+        self.items = ChainedItems([items for _, items, _ in sections])
+        self.rating_keys = []
+        self.ids_by_rating_key = {}
+        self.types = array('b')              # 1 for shows, 0 for everything else
+        self.years = array('H')              # 0 when unknown
+        self.release_ordinals = array('I')   # date.toordinal() of originallyAvailableAt, 0 when unknown
+        self.audience_ratings = array('d')   # 0.0 when missing
+        self.content_rating_ids = array('H')
+        self.content_ratings = []            # content rating id -> name
+        self.view_counts = array('I')        # viewCount for movies, viewedLeafCount for shows
+        self.text_indexes = [text_index for _, _, text_index in sections]
+        self.by_section = {}
+        self.by_genre = {}                   # lowercased genre tag -> ids
+        self.by_content_rating = {}
+        self.unwatched = set()
+
+        content_rating_lookup = {}
+        genre_names = set()
+        for key, items, _ in sections:
+            # Snapshot sections hand over their stored columns; the rest are computed here
+            columns = section_columns(items)
+            first_id = len(self.rating_keys)
+            section_ids = range(first_id, first_id + len(columns['rating_keys']))
+            self.by_section.setdefault(str(key), set()).update(section_ids)
+            self.rating_keys.extend(columns['rating_keys'])
+            self.ids_by_rating_key.update(zip(columns['rating_keys'], section_ids))
+            for name in ('types', 'years', 'release_ordinals', 'audience_ratings', 'view_counts'):
+                getattr(self, name).frombytes(memoryview(columns[name]).cast('B'))
+            self.unwatched.update(item_id for item_id, flag in zip(section_ids, columns['unwatched']) if flag)
+
+            # Content rating ids are per section, so map them onto this index's
+            section_rating_ids = []
+            for content_rating in columns['content_ratings']:
+                if content_rating not in content_rating_lookup:
+                    content_rating_lookup[content_rating] = len(self.content_ratings)
+                    self.content_ratings.append(content_rating)
+                    self.by_content_rating[content_rating] = set()
+                section_rating_ids.append(content_rating_lookup[content_rating])
+            for item_id, rating_id in zip(section_ids, columns['content_rating_ids']):
+                rating_id = section_rating_ids[rating_id]
+                self.content_rating_ids.append(rating_id)
+                self.by_content_rating[self.content_ratings[rating_id]].add(item_id)
+
+            genre_names.update(columns['genre_names'])
+            tags = [tag.lower() for tag in columns['genre_names']]
+            genre_offsets, genre_ids = columns['genre_offsets'], columns['genre_ids']
+            for position, item_id in enumerate(section_ids):
+                for genre_id in genre_ids[genre_offsets[position]:genre_offsets[position + 1]]:
+                    self.by_genre.setdefault(tags[genre_id], set()).add(item_id)
+
+        self.genres = sorted(genre_names)
+        # Sorted views of the range-filtered columns, so "newer than" and
+        # "at least" become a bisect plus a slice. Unknown values are left out.
+        self._release_order = sorted((i for i, d in enumerate(self.release_ordinals) if d), key=self.release_ordinals.__getitem__)
+        self._release_sorted = [self.release_ordinals[i] for i in self._release_order]
+        self._score_order = sorted((i for i, r in enumerate(self.audience_ratings) if r), key=self.audience_ratings.__getitem__)
+        self._score_sorted = [self.audience_ratings[i] for i in self._score_order]
+
+    def __len__(self):
+        return len(self.items)
+
+    def facets(self):
+        """Summary of the snapshot for the filter controls: genres, rating counts and item counts"""
+        shows = sum(self.types)
+        return {
+            'genres': self.genres,
+            'ratings': {rating: len(ids) for rating, ids in self.by_content_rating.items() if rating},
+            'counts': {'movies': len(self.items) - shows, 'shows': shows, 'unwatched': len(self.unwatched)}
+        }
+
+    def search(self, query):
+        """Return the ids of items whose title or summary matches a keyword query"""
+        rating_keys = set().union(*(text_index.search(query) for text_index in self.text_indexes))
+        # The text indexes may already know about items synced after this snapshot
+        return {self.ids_by_rating_key[k] for k in rating_keys if k in self.ids_by_rating_key}
+
+    def query(self, section_keys, filters):
+        """Return the ids of items in the given sections that match the spin filters"""
+        matches = set().union(*(self.by_section.get(str(key), ()) for key in section_keys))
+        if filters.get('unwatched'):
+            matches &= self.unwatched
+        if filters.get('genre'):
+            # Handle combined genres like "Action/Adventure" - match if any part matches
+            genre_parts = [g.strip() for g in filters['genre'].lower().split('/')]
+            matches &= set().union(*(ids for tag, ids in self.by_genre.items() if any(part in tag for part in genre_parts)))
+        if filters.get('rating'):
+            matches &= self.by_content_rating.get(filters['rating'], set())
+        if filters.get('recent_releases'):
+            cutoff = (datetime.now() - timedelta(days=5 * 365)).toordinal()
+            matches &= set(self._release_order[bisect_right(self._release_sorted, cutoff):])
+        if filters.get('min_score'):
+            min_score = float(filters['min_score'])
+            matches &= set(self._score_order[bisect_left(self._score_sorted, min_score):])
+        if filters.get('keyword'):
+            matches &= self.search(filters['keyword'])
+        return matches
+
+# Spin indexes keyed by server and the sections they cover. Each holds only
+# the newest generations; its snapshot records which ones
+_library_index_cache = OrderedDict()
+_library_index_lock = threading.Lock()
+LIBRARY_INDEX_CACHE_SIZE = 4
+
+def get_library_index(keys, wait=True):
+    """Return a LibraryIndex over the given sections, syncing them first if needed.
+
+    With ``wait`` unset, sections that have never been synced are left to the
+    background refresher and None is returned until all of them are cached.
+    """
+    # Worker threads have no request context, so resolve the session values here
+    server_url, token = get_plex_connection()
+    states = get_library_states(keys, server_url, token, wait)
+    if not wait and None in states:
+        return None
+    sections = [(key, state) for key, state in zip(keys, states) if state is not None]
+    # One index per set of sections: a sync that changes a generation replaces
+    # the entry, so the old index and the snapshot it maps are freed
+    cache_key = (server_url, tuple(str(key) for key, _ in sections))
+    index_key = (server_url, tuple((str(key), state['generation']) for key, state in sections))
+    with _library_index_lock:
+        index = _library_index_cache.get(cache_key)
+        if index is not None:
+            _library_index_cache.move_to_end(cache_key)
+    if index is not None and index.snapshot == index_key:
+        CACHE_REQUESTS.inc(cache='library_index', result='hit')
+        return index
+    CACHE_REQUESTS.inc(cache='library_index', result='miss')
+    for _, state in sections:
+        if 'text_index' not in state:
+            state['text_index'] = TextIndex(state['items'])
+    index = LibraryIndex([(key, state['items'], state['text_index']) for key, state in sections], index_key)
+    with _library_index_lock:
+        _library_index_cache[cache_key] = index
+        _library_index_cache.move_to_end(cache_key)
+        while len(_library_index_cache) > LIBRARY_INDEX_CACHE_SIZE:
+            _library_index_cache.popitem(last=False)
+    return index
+
+# Filter pushdown. While a library has never been synced, a spin asks Plex
+# for just the items matching its filters instead of waiting for the whole
+# section. Each filter Plex can evaluate becomes a query parameter that
+# selects a superset of what the local filter accepts; the spin then filters
+# the results locally, so it picks from exactly the same items a synced
+# index would. Keyword is always filtered locally since Plex only searches titles.
+PUSHDOWN_FILTERS = ('genre', 'rating', 'recent_releases', 'min_score', 'unwatched')
+PUSHDOWN_CACHE_SECONDS = 60
+PUSHDOWN_CACHE_SIZE = 8
+PLEX_SECTION_TYPES = {'movie': 1, 'show': 2}
+_section_genres = {}              # (server_url, section key) -> (fetched_at, [(genre id, tag)])
+_pushdown_cache = OrderedDict()   # (server_url, section keys) -> LibraryIndex for the latest filters
+_pushdown_lock = threading.Lock()
+
+def fetch_section_genres(server_url, token, key):
+    """The (id, tag) of every genre in a section; Plex filters genres by id"""
+    cache_key = (server_url, str(key))
+    cached = _section_genres.get(cache_key)
+    if cached and time.time() - cached[0] < LIBRARY_CACHE_TTL:
+        return cached[1]
+    return single_flight(('genres',) + cache_key, _fetch_section_genres, server_url, token, key)
+
+def _fetch_section_genres(server_url, token, key):
+    cache_key = (server_url, str(key))
+    r = plex_get(server_url, f"/library/sections/{key}/genre", headers={'Accept': 'application/json'},
+                 params={'X-Plex-Token': token}, timeout=15)
+    r.raise_for_status()
+    genres = []
+    for directory in r.json().get('MediaContainer', {}).get('Directory', []):
+        # Newer servers put the id in "key", older ones only in the "fastKey" URL
+        genre_id = str(directory.get('key', ''))
+        if not genre_id.isdigit():
+            match = re.search(r"genre=(\d+)", directory.get('fastKey') or genre_id)
+            if not match:
+                continue
+            genre_id = match.group(1)
+        genres.append((genre_id, directory.get('title', '')))
+    _section_genres[cache_key] = (time.time(), genres)
+    return genres
+
+def plan_section_query(filters, section_type, genres):
+    """Translate spin filters into Plex section query parameters.
+
+    Returns None when nothing in the section can match.
+    """
+    params = {}
+    if section_type in PLEX_SECTION_TYPES:
+        params['type'] = PLEX_SECTION_TYPES[section_type]
+    if filters.get('genre'):
+        # Same "any part of Action/Adventure is in the tag" rule as LibraryIndex.query;
+        # Plex ORs comma-separated genre ids
+        genre_parts = [g.strip() for g in filters['genre'].lower().split('/')]
+        genre_ids = [genre_id for genre_id, tag in genres if any(part in tag.lower() for part in genre_parts)]
+        if not genre_ids:
+            return None
+        params['genre'] = ','.join(genre_ids)
+    if filters.get('rating'):
+        params['contentRating'] = filters['rating']
+    if filters.get('recent_releases'):
+        cutoff = datetime.now() - timedelta(days=5 * 365)
+        params['originallyAvailableAt>>'] = cutoff.strftime('%Y-%m-%d')
+    if filters.get('min_score'):
+        # Plex's >> is strict and ratings have one decimal, so ask for just below the minimum
+        params['audienceRating>>'] = f"{float(filters['min_score']) - 0.05:.2f}"
+    if filters.get('unwatched'):
+        # For shows Plex means "has unwatched episodes", a superset of never watched
+        params['unwatched'] = 1
+    return params
+
+def get_pushdown_index(section_keys, filters):
+    """LibraryIndex over only the items of the given sections that Plex says may match the filters"""
+    server_url, token = get_plex_connection()
+    # Only the latest filters are kept per set of sections; the snapshot is
+    # ('pushdown', server_url, filter signature, fetch time)
+    cache_key = (server_url, tuple(sorted(str(key) for key in section_keys)))
+    signature = filter_signature(section_keys, filters)
+    with _pushdown_lock:
+        index = _pushdown_cache.get(cache_key)
+        if index is not None and time.time() - index.snapshot[-1] >= PUSHDOWN_CACHE_SECONDS:
+            del _pushdown_cache[cache_key]
+            index = None
+    if index is not None and index.snapshot[2] == signature:
+        CACHE_REQUESTS.inc(cache='pushdown', result='hit')
+        return index
+    CACHE_REQUESTS.inc(cache='pushdown', result='miss')
+
+    section_types = {str(lib.get('key')): lib.get('type') for lib in load_config().get('plex_libraries', [])}
+
+    def fetch(key):
+        genres = fetch_section_genres(server_url, token, key) if filters.get('genre') else []
+        params = plan_section_query(filters, section_types.get(str(key)), genres)
+        return [] if params is None else fetch_library_items(server_url, token, key, params)
+
+    futures = [_fetch_executor.submit(fetch, key) for key in section_keys]
+    sections = [(key, items, TextIndex(items)) for key, items in zip(section_keys, (f.result() for f in futures))]
+    index = LibraryIndex(sections, ('pushdown', server_url, signature, time.time()))
+    log.debug("Filtered Plex query returned %d candidate items", len(index))
+    with _pushdown_lock:
+        _pushdown_cache[cache_key] = index
+        _pushdown_cache.move_to_end(cache_key)
+        while len(_pushdown_cache) > PUSHDOWN_CACHE_SIZE:
+            _pushdown_cache.popitem(last=False)
+    return index
+
+class SpinSample:
+    """Stands in for a ShuffleBag when a spin sampled Plex directly.
+
+    ``remaining`` is an estimate: the matches minus everything this state
+    has been shown, whatever the filters were at the time. When
+    ``upper_bound`` is set, ``total_matching`` counts items Plex returned
+    for a query looser than the filters, so fewer may actually match.
+    """
+
+    __slots__ = ('total_matching', 'repeating', 'remaining', 'upper_bound')
+
+    def __init__(self, total_matching, repeating, remaining, upper_bound=False):
+        self.total_matching = total_matching
+        self.repeating = repeating
+        self.remaining = remaining
+        self.upper_bound = upper_bound
+
+    def __len__(self):
+        return self.remaining
+
+def sample_spin(section_keys, filters, picks, state_id):
+    """Pick items by asking Plex for match counts and a few randomly sorted matches.
 
-def build_item_data(item, machine_id):
+    Moves a handful of items per spin no matter how large the library is.
+    Returns the picked items and a SpinSample, or None when no sampled item
+    could be picked but the sample didn't cover all of Plex's candidates.
+    """
+    server_url, token = get_plex_connection()
+    section_types = {str(lib.get('key')): lib.get('type') for lib in load_config().get('plex_libraries', [])}
+
+    def count(key):
+        genres = fetch_section_genres(server_url, token, key) if filters.get('genre') else []
+        params = plan_section_query(filters, section_types.get(str(key)), genres)
+        return (key, params, 0 if params is None else fetch_library_size(server_url, token, key, params))
+
+    counts = [c for c in _fetch_executor.map(count, section_keys) if c[2]]
+    total = sum(size for _, _, size in counts)
+    if not total:
+        return [], SpinSample(0, False, 0)
+
+    # Spread the picks over the sections by size so every match is equally likely
+    chosen = random.choices(range(len(counts)), weights=[size for _, _, size in counts], k=picks)
+
+    def sample(i):
+        key, params, size = counts[i]
+        page = dict(params, sort='random')
+        page_size = min(size, chosen.count(i) + SPIN_SAMPLE_OVERFETCH)
+        items = []
+        for item in iter_library_items(server_url, token, key, page, page_size=page_size):
+            items.append(item)
+            if len(items) >= page_size:
+                break
+        # Plex's filters can be looser than ours, so re-check every item locally
+        index = LibraryIndex([(key, items, TextIndex(items))])
+        matches = [index.items[j] for j in index.query([key], filters)]
+        random.shuffle(matches)
+        return i, items, matches
+
+    sampled = list(_fetch_executor.map(sample, sorted(set(chosen))))
+    sampled_count = sum(len(items) for _, items, _ in sampled)
+    seen = load_seen_keys(state_id)
+
+    # Each section gives the picks it was chosen for from its own sample;
+    # only when one runs short do the others' leftovers fill in
+    selected, leftovers = [], []
+    for i, _, matches in sampled:
+        unseen = [item for item in matches if item.get('ratingKey') not in seen]
+        selected.extend(unseen[:chosen.count(i)])
+        leftovers.extend(unseen[chosen.count(i):])
+    if len(selected) < picks:
+        random.shuffle(leftovers)
+        selected.extend(leftovers[:picks - len(selected)])
+    random.shuffle(selected)
+
+    if not selected and sampled_count < total:
+        return None
+
+    # Plex's count is exact for sections sampled in full; otherwise it is
+    # only an upper bound when Plex's query is known to be, or was seen to
+    # be, looser than the filters
+    total_matching, upper_bound = 0, False
+    sampled_by_section = {i: (items, matches) for i, items, matches in sampled}
+    for i, (key, _, size) in enumerate(counts):
+        items, matches = sampled_by_section.get(i, ((), ()))
+        if len(items) == size:
+            total_matching += len(matches)
+            continue
+        total_matching += size
+        if len(matches) < len(items) or (filters.get('unwatched') and section_types.get(str(key)) == 'show'):
+            upper_bound = True
+
+    repeating = False
+    if not selected and total_matching:
+        # Every match has been shown; allow repeats like spin_library does
+        repeating = True
+        matches = [item for _, _, section_matches in sampled for item in section_matches]
+        random.shuffle(matches)
+        selected = matches[:picks]
+    else:
+        add_seen_keys(state_id, [item.get('ratingKey') for item in selected])
+        seen.update(item.get('ratingKey') for item in selected)
+    log.debug("Sampled %d of %d candidate items from Plex", sampled_count, total)
+    return selected, SpinSample(total_matching, repeating, 0 if repeating else max(total_matching - len(seen), 0),
+                                upper_bound)
+
+def run_spin(library_keys, section_keys, filters, picks, state_id, seen_epoch):
+    """Pick items for a spin without waiting on a full library download when avoidable.
+
+    Returns the picked items and the ShuffleBag (or SpinSample) they came from.
+    """
+    with SPIN_STAGE_SECONDS.time(stage='load_library'):
+        library = get_library_index(library_keys, wait=False)
+    if library is None and LIGHTWEIGHT_SPIN and not filters.get('keyword'):
+        try:
+            with SPIN_STAGE_SECONDS.time(stage='sample'):
+                result = sample_spin(section_keys, filters, picks, state_id)
+            if result is not None:
+                return result
+        except Exception as e:
+            log.warning("Sampling Plex failed, fetching matching items instead: %s", plex_error(e))
+    if library is None:
+        with SPIN_STAGE_SECONDS.time(stage='load_library'):
+            library = get_spin_index(library_keys, section_keys, filters)
+    return spin_library(library, section_keys, filters, picks, state_id, seen_epoch)
+
+def get_spin_index(library_keys, section_keys, filters):
+    """The index a spin draws from: the synced libraries when cached, otherwise a filtered Plex query"""
+    library = get_library_index(library_keys, wait=False)
+    if library is not None:
+        return library
+    if any(filters.get(name) for name in PUSHDOWN_FILTERS):
+        try:
+            return get_pushdown_index(section_keys, filters)
+        except Exception as e:
+            log.warning("Filtered Plex query failed, fetching whole libraries: %s", plex_error(e))
+    return get_library_index(library_keys)
+
+class ShuffleBag:
+    """A lazily shuffled permutation of item ids.
+
+    Each draw performs one Fisher-Yates step, so drawing k items costs O(k)
+    no matter how many items the bag holds. Positions that have been swapped
+    are tracked sparsely in ``swaps``; ``ids`` itself is never modified.
+    """
+
+    __slots__ = ('ids', 'cursor', 'swaps', 'total_matching', 'repeating', 'snapshot', 'seen_epoch', 'lock')
+
+    def __init__(self, ids, total_matching, repeating, snapshot, seen_epoch):
+        self.ids = ids
+        self.cursor = 0
+        self.swaps = {}
+        self.total_matching = total_matching
+        self.repeating = repeating       # True once every matching item has been shown
+        self.snapshot = snapshot
+        self.seen_epoch = seen_epoch
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids) - self.cursor
+
+    def draw(self):
+        i = self.cursor
+        j = random.randrange(i, len(self.ids))
+        picked = self.swaps.get(j, self.ids[j])
+        if j != i:
+            self.swaps[j] = self.swaps.get(i, self.ids[i])
+        self.swaps.pop(i, None)
+        self.cursor += 1
+        return picked
+
+# Shuffle bags per (spin state, filter signature), least-recently-used evicted
+_spin_bags = OrderedDict()
+_spin_bags_lock = threading.Lock()
+SPIN_BAG_CACHE_SIZE = 1000
+
+def filter_signature(section_keys, filters):
+    """Normalize the filters that affect which items match into a hashable key"""
+    return json.dumps([
+        sorted(str(key) for key in section_keys),
+        (filters.get('genre') or '').lower(),
+        filters.get('rating') or '',
+        ' '.join(tokenize(filters.get('keyword') or '')),
+        filters.get('min_score') or '',
+        bool(filters.get('unwatched')),
+        bool(filters.get('recent_releases'))
+    ])
+
+def _seed_bag(library, section_keys, filters, state_id, seen_epoch, repeating=False):
+    with SPIN_STAGE_SECONDS.time(stage='filter'):
+        matching = library.query(section_keys, filters)
+    pool = matching
+    if not repeating:
+        seen_ids = {library.ids_by_rating_key[k] for k in load_seen_keys(state_id) if k in library.ids_by_rating_key}
+        pool = matching - seen_ids
+        # If all seen, use the full matching set (allow repeats)
+        repeating = not pool and bool(matching)
+        if repeating:
+            pool = matching
+    log.debug("Seeded spin bag: %d of %d matching items (repeating=%s)", len(pool), len(matching), repeating)
+    return ShuffleBag(list(pool), len(matching), repeating, library.snapshot, seen_epoch)
+
+def spin_library(library, section_keys, filters, picks, state_id, seen_epoch=0):
+    """Pick up to ``picks`` matching items this state has not been shown yet.
+
+    Returns the picked items and the bag they came from, whose length is the
+    number of unseen matches left. The bag is reseeded when the filters,
+    library snapshot or seen epoch change.
+    """
+    bag_key = (state_id, filter_signature(section_keys, filters))
+    with _spin_bags_lock:
+        bag = _spin_bags.get(bag_key)
+        if bag is not None:
+            _spin_bags.move_to_end(bag_key)
+    if bag is None or bag.snapshot != library.snapshot or bag.seen_epoch != seen_epoch:
+        CACHE_REQUESTS.inc(cache='spin_bag', result='miss')
+        bag = _seed_bag(library, section_keys, filters, state_id, seen_epoch)
+    else:
+        CACHE_REQUESTS.inc(cache='spin_bag', result='hit')
+
+    selected = []
+    draw_started = time.perf_counter()
+    with bag.lock:
+        while len(selected) < picks:
+            if not bag:
+                # Every match has been shown; start a new cycle with repeats allowed,
+                # but never show the same item twice in one spin
+                if selected or not bag.total_matching:
+                    break
+                bag = _seed_bag(library, section_keys, filters, state_id, seen_epoch, repeating=True)
+                continue
+            item = library.items[bag.draw()]
+            # Another worker may have shown this item since the bag was seeded
+            if not bag.repeating and is_seen_key(state_id, item.get('ratingKey')):
+                continue
+            selected.append(item)
+    SPIN_STAGE_SECONDS.observe(time.perf_counter() - draw_started, stage='draw')
+
+    with _spin_bags_lock:
+        _spin_bags[bag_key] = bag
+        _spin_bags.move_to_end(bag_key)
+        while len(_spin_bags) > SPIN_BAG_CACHE_SIZE:
+            _spin_bags.popitem(last=False)
+    if not bag.repeating:
+        add_seen_keys(state_id, [item.get('ratingKey') for item in selected])
+    return selected, bag
+
+def spin_section_keys(media_type, movie_keys, show_keys):
+    """The sections a spin for the chosen media type draws from"""
+    if media_type == 'movie' and movie_keys:
+        return movie_keys
+    if media_type == 'show' and show_keys:
+        return show_keys
+    return movie_keys + show_keys
+
+def build_item_data(item, server_url, machine_id):
     rating_key = item.get('ratingKey')
     duration = item.get('duration')
     runtime = int(duration / 60000) if duration else None
@@ -390,8 +2578,9 @@ def build_item_data(item, machine_id):
         'year': item.get('year'),
         'summary': item.get('summary', 'No summary available.'),
         'genres': ', '.join([g['tag'] for g in item.get('Genre', [])]) if 'Genre' in item else '',
-        'poster': f"{session.get('plex_server_url')}{item.get('thumb')}?X-Plex-Token={session.get('plex_token')}" if item.get('thumb') else '',
-        'link': f"{session.get('plex_server_url')}/web/index.html#!/server/{machine_id}/details?key=%2Flibrary%2Fmetadata%2F{rating_key}",
+        'rating_key': rating_key,
+        'poster': poster_url(rating_key, item.get('thumb')) if item.get('thumb') else '',
+        'link': plex_item_link(server_url, machine_id, rating_key),
         'rating': item.get('contentRating', 'Unrated'),
         'runtime': str(runtime) if runtime else 'N/A',
         'audience_rating': f"{item.get('audienceRating', 0):.1f}" if item.get('audienceRating') else None,
@@ -399,21 +2588,171 @@ def build_item_data(item, machine_id):
         'media_type': 'TV Show' if item_type == 'show' else 'Movie'
     }
 
+# Matches the Plex thumb path in poster URLs saved before posters were proxied
+_PLEX_THUMB_RE = re.compile(r"/library/metadata/(\d+)/thumb(?:/(\d+))?")
+
+def poster_url(rating_key, thumb):
+    """URL of the proxied poster; the thumb's timestamp versions it for caching"""
+    version = thumb.rstrip('/').rsplit('/', 1)[-1] if thumb else None
+    return url_for('poster', rating_key=rating_key, v=version if version and version.isdigit() else None)
+
+def proxy_poster_url(url):
+    """Rewrite a direct Plex poster URL (which embeds the token) to the poster proxy"""
+    if not url or 'X-Plex-Token' not in url:
+        return url
+    match = _PLEX_THUMB_RE.search(url)
+    if not match:
+        return ''
+    return url_for('poster', rating_key=match.group(1), v=match.group(2))
+
+# Size of the poster cache as this worker last counted it, plus what it has
+# written since. The directory is only scanned again once that passes the
+# limit, since other workers' writes aren't included.
+_poster_cache_bytes = None
+_poster_cache_lock = threading.Lock()
+
+def _evict_posters(keep):
+    """Delete least-recently-used posters (except ``keep``) until the cache is under its size limit.
+
+    Returns the size of the cache afterwards.
+    """
+    entries = []
+    total = 0
+    for entry in os.scandir(POSTER_CACHE_DIR):
+        if entry.is_file() and entry.name.endswith('.jpg'):
+            stat = entry.stat()
+            total += stat.st_size
+            if entry.path != keep:
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+    limit = POSTER_CACHE_MAX_MB * 1024 * 1024
+    if total <= limit:
+        return total
+    # Trim to 90% so we don't evict again on the very next write
+    for _, size, path in sorted(entries):
+        if total <= limit * 0.9:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+    return total
+
+def _count_poster_write(size, path):
+    """Add a newly cached poster to the running size, evicting once it passes the limit"""
+    global _poster_cache_bytes
+    with _poster_cache_lock:
+        if _poster_cache_bytes is not None:
+            _poster_cache_bytes += size
+            if _poster_cache_bytes <= POSTER_CACHE_MAX_MB * 1024 * 1024:
+                return
+        _poster_cache_bytes = _evict_posters(keep=path)
+
+@app.route('/poster/<rating_key>')
+@api_auth_required
+def poster(rating_key):
+    """Serve a poster resized by Plex, cached on disk so the token never reaches the browser"""
+    version = request.args.get('v', '')
+    if not rating_key.isdigit() or (version and not version.isdigit()):
+        abort(404)
+    name = f"{rating_key}-{version}" if version else rating_key
+    path = os.path.join(POSTER_CACHE_DIR, f"{name}.jpg")
+
+    # Served from an open file, so another worker evicting the poster
+    # meanwhile can't pull it out from under the response
+    try:
+        poster_file = open(path, 'rb')
+        fetched_at = os.fstat(poster_file.fileno()).st_mtime_ns
+    except FileNotFoundError:
+        poster_file = None
+    if poster_file and (version or time.time_ns() - fetched_at < POSTER_UNVERSIONED_TTL * 10**9):
+        CACHE_REQUESTS.inc(cache='poster', result='hit')
+        # The access time marks it as recently used for LRU eviction; the
+        # modification time stays the time it was fetched
+        try:
+            os.utime(path, ns=(time.time_ns(), fetched_at))
+        except FileNotFoundError:
+            pass
+    else:
+        CACHE_REQUESTS.inc(cache='poster', result='miss')
+        config = load_config()
+        server_url = config.get('plex_server_url')
+        thumb = f"/library/metadata/{rating_key}/thumb" + (f"/{version}" if version else '')
+
+        def fetch_poster():
+            r = plex_get(server_url, '/photo/:/transcode', params={
+                'url': thumb,
+                'width': POSTER_WIDTH,
+                'height': POSTER_HEIGHT,
+                'minSize': 1,
+                'X-Plex-Token': config.get('plex_token')
+            }, timeout=15)
+            r.raise_for_status()
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with STORAGE_SECONDS.time(operation='poster_write'):
+                with open(tmp_path, 'wb') as f:
+                    f.write(r.content)
+                os.replace(tmp_path, path)
+            _count_poster_write(len(r.content), path)
+            return r.content
+
+        try:
+            # A page full of the same poster (history, results) fetches it once
+            content = single_flight(('poster', path), fetch_poster)
+        except Exception as e:
+            log.warning("Failed to fetch poster %s: %s", rating_key, plex_error(e))
+            # An expired poster is still better than none
+            if poster_file is None:
+                abort(404)
+        else:
+            if poster_file:
+                poster_file.close()
+            try:
+                poster_file = open(path, 'rb')
+                fetched_at = os.fstat(poster_file.fileno()).st_mtime_ns
+            except FileNotFoundError:
+                # Evicted by another worker already
+                poster_file, fetched_at = io.BytesIO(content), time.time_ns()
+
+    # Versioned URLs never change content; unversioned ones are revalidated
+    # by an ETag that changes whenever the poster is refetched
+    etag = name if version else f"{name}-{fetched_at}"
+    response = send_file(poster_file, mimetype='image/jpeg', etag=etag, conditional=True,
+                         max_age=POSTER_MAX_AGE if version else 0)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    if version:
+        response.cache_control.immutable = True
+    return response
+
 @app.route('/export_watchlist')
 @login_required
 def export_watchlist():
-    watchlist = load_watchlist()
+    # Written one item at a time straight from the database, so large
+    # watchlists are never held in memory as a whole
     export_format = request.args.get('format', 'json')
     if export_format == 'csv':
         headers = ['title', 'year', 'summary', 'genres', 'poster', 'link', 'rating', 'runtime', 'audience_rating']
-        output = [headers] + [[item.get(h, '') for h in headers] for item in watchlist]
-        lines = []
-        for row in output:
-            cells = ['"{}"'.format(str(cell).replace('"', '""')) for cell in row]
-            lines.append(','.join(cells))
-        csv_text = '\n'.join(lines)
-        return Response(csv_text, mimetype='text/csv', headers={'Content-Disposition': 'attachment; filename=watchlist.csv'})
-    return Response(json.dumps(watchlist, indent=2), mimetype='application/json', headers={'Content-Disposition': 'attachment; filename=watchlist.json'})
+
+        def csv_row(row):
+            return ','.join('"{}"'.format(str(cell).replace('"', '""')) for cell in row)
+
+        def generate():
+            yield csv_row(headers)
+            for item in iter_watchlist():
+                yield '\n' + csv_row(item.get(h, '') for h in headers)
+        return Response(stream_with_context(generate()), mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=watchlist.csv'})
+
+    def generate():
+        # Same output as json.dumps(watchlist, indent=2)
+        separator = '[\n'
+        for item in iter_watchlist():
+            yield separator + '  ' + json.dumps(item, indent=2).replace('\n', '\n  ')
+            separator = ',\n'
+        yield '\n]' if separator == ',\n' else '[]'
+    return Response(stream_with_context(generate()), mimetype='application/json',
+                    headers={'Content-Disposition': 'attachment; filename=watchlist.json'})
 
 @app.route('/', methods=['GET', 'POST'])
 @login_required
@@ -433,56 +2772,44 @@ def index():
     if not session.get("plex_token") or not session.get("plex_server_url"):
         return redirect(url_for('plex_login'))
 
-    # Support both old single-value and new multi-value config
-    movies_libraries = config.get('movies_libraries', [])
-    tvshows_libraries = config.get('tvshows_libraries', [])
-    
-    # Backward compatibility: if no arrays but old single values exist, use those
-    if not movies_libraries and config.get('movies_library'):
-        movies_libraries = [config.get('movies_library')]
-    if not tvshows_libraries and config.get('tvshows_library'):
-        tvshows_libraries = [config.get('tvshows_library')]
-    
+    movies_libraries, tvshows_libraries = get_configured_libraries(config)
     if not movies_libraries and not tvshows_libraries:
         return redirect(url_for('settings'))
 
     movie_keys = get_library_keys(movies_libraries)
     show_keys = get_library_keys(tvshows_libraries)
-    machine_id = get_machine_identifier()
-    items = []
-
-    for key in movie_keys:
-        items += get_items_from_library(key)
-    for key in show_keys:
-        items += get_items_from_library(key)
+    # Never wait on Plex just to render the page; until the libraries are
+    # cached the genre list is loaded by the page from /api/facets
+    library = get_library_index(movie_keys + show_keys, wait=False)
 
-    genres = extract_genres(items)
     form = request.form
-    results = session.get('saved_results', [])  # Restore results from session
-    filters = session.get('filters', {})  # Get saved filters
+    state_id = get_state_id()
+    spin_state = load_spin_state(state_id)
 
     if request.method == 'POST':
-        print(f"POST received. Form keys: {list(form.keys())}", flush=True)
+        log.debug("POST received. Form keys: %s", list(form.keys()))
         if 'toggle_history' in form:
-            session['show_history'] = not session.get('show_history', False)
+            spin_state['show_history'] = not spin_state['show_history']
+            save_spin_state(state_id, spin_state)
         elif 'clear_history' in form:
-            save_pick_history(session.get('username', 'default'), [])
+            clear_pick_history(session.get('username', 'default'))
         elif 'reset_filters' in form:
-            # Clear saved filters and results
-            session.pop('filters', None)
-            session.pop('saved_results', None)
-            session.pop('seen_items', None)  # Also reset seen items when filters change
+            # Clear saved filters and results, and reset seen items since filters change
+            spin_state.update(filters={}, results=[], all_seen=False, total_matching=0, remaining=0,
+                              seen_epoch=spin_state['seen_epoch'] + 1)
+            save_spin_state(state_id, spin_state)
+            clear_seen_keys(state_id)
         elif 'reset_seen' in form:
-            # Clear seen items and results
-            session.pop('seen_items', None)
-            session.pop('saved_results', None)
-            session.pop('seen_count', None)
-            session.pop('all_seen', None)
-            session.pop('total_matching', None)
+            # Clear seen items and results; the new epoch makes every worker reseed its bags
+            spin_state.update(results=[], all_seen=False, total_matching=0, remaining=0,
+                              seen_epoch=spin_state['seen_epoch'] + 1)
+            save_spin_state(state_id, spin_state)
+            clear_seen_keys(state_id)
         elif 'add_to_watchlist' in form:
             item = {
                 'title': form.get('saved_title'),
                 'year': form.get('saved_year'),
+                'rating_key': form.get('saved_rating_key'),
                 'summary': form.get('saved_summary'),
                 'genres': form.get('saved_genres'),
                 'poster': form.get('saved_poster'),
@@ -493,21 +2820,16 @@ def index():
                 'media_type': form.get('saved_media_type', 'Movie')
             }
             if item['title'] and item['year']:
-                watchlist = load_watchlist()
-                if not any(w['title'] == item['title'] and str(w['year']) == str(item['year']) for w in watchlist):
-                    watchlist.append(item)
-                    with open(WATCHLIST_FILE, 'w') as f:
-                        json.dump(watchlist, f, indent=2)
+                add_watchlist_item(item)
             return redirect(url_for('watchlist'))
         else:
-            print("Entering spin logic...", flush=True)
+            spin_started = time.perf_counter()
             media_type = form.get('media_type', 'both')
             unwatched = 'unwatched' in form
-            filtered = []
-            print(f"media_type={media_type}, unwatched={unwatched}, genre={form.get('genre')}", flush=True)
+            log.debug("Spinning: media_type=%s, unwatched=%s, genre=%s", media_type, unwatched, form.get('genre'))
 
-            # Save filter settings to session
-            session['filters'] = {
+            # Save filter settings
+            spin_state['filters'] = {
                 'media_type': media_type,
                 'genre': form.get('genre', ''),
                 'rating': form.get('rating', ''),
@@ -518,112 +2840,147 @@ def index():
                 'show_three': 'show_three' in form
             }
 
-            if media_type == 'movie' and movie_keys:
-                for key in movie_keys:
-                    filtered += get_items_from_library(key, unwatched=unwatched)
-            elif media_type == 'show' and show_keys:
-                for key in show_keys:
-                    filtered += get_items_from_library(key, unwatched=unwatched)
-            else:
-                for key in movie_keys:
-                    filtered += get_items_from_library(key, unwatched=unwatched)
-                for key in show_keys:
-                    filtered += get_items_from_library(key, unwatched=unwatched)
-            
-            print(f"After fetch: {len(filtered)} items total", flush=True)
-
-            # Additional client-side unwatched filter (Plex API param unreliable for shows)
-            if unwatched:
-                def is_unwatched(item):
-                    # For movies: viewCount = 0 or missing means unwatched
-                    # For shows: viewedLeafCount = 0 or missing means fully unwatched
-                    if item.get('type') == 'show':
-                        return item.get('viewedLeafCount', 0) == 0
-                    else:
-                        return item.get('viewCount', 0) == 0
-                before_filter = len(filtered)
-                filtered = [i for i in filtered if is_unwatched(i)]
-                print(f"After unwatched client filter: {len(filtered)} items (removed {before_filter - len(filtered)})", flush=True)
-
-            if form.get('genre'):
-                selected_genre = form.get('genre').lower()
-                # Handle combined genres like "Action/Adventure" - match if any part matches
-                genre_parts = [g.strip().lower() for g in selected_genre.split('/')]
-                filtered = [i for i in filtered if any(
-                    any(part in g['tag'].lower() for part in genre_parts)
-                    for g in i.get('Genre', [])
-                )]
-                print(f"After genre filter ({form.get('genre')}): {len(filtered)} items", flush=True)
-            if form.get('rating'):
-                filtered = [i for i in filtered if i.get('contentRating') == form.get('rating')]
-            if form.get('keyword'):
-                filtered = [i for i in filtered if form.get('keyword').lower() in i.get('summary', '').lower()]
-            if form.get('recent_releases'):
-                cutoff = datetime.now() - timedelta(days=5 * 365)
-                filtered = [i for i in filtered if i.get('originallyAvailableAt') and datetime.strptime(i.get('originallyAvailableAt'), "%Y-%m-%d") > cutoff]
-            if form.get('min_score'):
-                min_score = float(form.get('min_score'))
-                filtered = [i for i in filtered if i.get('audienceRating') and float(i.get('audienceRating', 0)) >= min_score]
-                print(f"After min_score filter ({min_score}+): {len(filtered)} items", flush=True)
-
-            print(f"Final filtered count: {len(filtered)}", flush=True)
-            
-            # Track seen items to avoid repeats
-            seen_items = set(session.get('seen_items', []))
-            total_matching = len(filtered)
-            
-            # Filter out already-seen items
-            unseen = [i for i in filtered if i.get('ratingKey') not in seen_items]
-            print(f"Unseen items: {len(unseen)} of {total_matching}", flush=True)
-            
-            # Check if all unique items exhausted
-            all_seen = len(unseen) == 0 and total_matching > 0
-            
-            # If all seen, use full filtered list (allow repeats)
-            pool = unseen if unseen else filtered
-            
+            section_keys = spin_section_keys(media_type, movie_keys, show_keys)
             picks = 3 if 'show_three' in form else 1
-            selected = random.sample(pool, min(picks, len(pool)))
-            results = [build_item_data(i, machine_id) for i in selected]
-            print(f"Picked {len(results)} result(s): {[r['title'] for r in results]}", flush=True)
-            
-            # Add picked items to seen list
-            for item in selected:
-                seen_items.add(item.get('ratingKey'))
-            session['seen_items'] = list(seen_items)
-            session['all_seen'] = all_seen
-            session['seen_count'] = len(seen_items)
-            session['total_matching'] = total_matching
+            server_url, token = get_plex_connection()
+            machine_id = get_machine_identifier(server_url, token)
+            selected, bag = run_spin(movie_keys + show_keys, section_keys, spin_state['filters'], picks,
+                                     state_id, spin_state['seen_epoch'])
+            with SPIN_STAGE_SECONDS.time(stage='build_results'):
+                results = [build_item_data(i, server_url, machine_id) for i in selected]
+            SPIN_SECONDS.observe(time.perf_counter() - spin_started, source='page')
+            log.debug("Picked %d result(s), %d unseen left: %s", len(results), len(bag), [r['title'] for r in results])
 
-            # Save results to session
-            session['saved_results'] = results
+            spin_state.update(results=results, all_seen=bag.repeating, total_matching=bag.total_matching,
+                              remaining=0 if bag.repeating else len(bag))
+            save_spin_state(state_id, spin_state)
 
             if config.get('enable_history', True):
-                username = session.get('username', 'default')
-                history = load_pick_history(username)
-                history.extend(results)
-                save_pick_history(username, history)
+                append_pick_history(session.get('username', 'default'), results, get_history_limit(config))
 
-    # Load history from file for display
-    pick_history = load_pick_history(session.get('username', 'default')) if config.get('enable_history', True) else []
-    
-    # Get current filters (may have been updated during POST)
-    filters = session.get('filters', {})
+    # Load history for display, one page at a time and only while it is shown
+    pick_history, history_total = [], 0
+    history_page = max(request.args.get('history_page', 1, type=int), 1)
+    if config.get('enable_history', True) and spin_state['show_history']:
+        pick_history, history_total = load_pick_history(session.get('username', 'default'), history_page)
 
     return render_template('index.html',
-                           results=results,
-                           genres=genres,
+                           results=spin_state['results'],
+                           genres=library.genres if library else [],
+                           facets_pending=library is None,
                            rating_options=RATING_OPTIONS,
                            pick_history=pick_history,
-                           show_history=session.get('show_history', False),
-                           filters=filters,
+                           history_page=history_page,
+                           history_pages=-(-history_total // HISTORY_PAGE_SIZE),
+                           show_history=spin_state['show_history'],
+                           filters=spin_state['filters'],
                            has_movies=bool(movie_keys),
                            has_tvshows=bool(show_keys),
                            default_theme=config.get("default_theme", "dark"),
                            config=config,
-                           all_seen=session.get('all_seen', False),
-                           seen_count=session.get('seen_count', 0),
-                           total_matching=session.get('total_matching', 0))
+                           all_seen=spin_state['all_seen'],
+                           seen_count=spin_state['total_matching'] - spin_state['remaining'],
+                           total_matching=spin_state['total_matching'])
+
+@app.route('/api/facets')
+@login_required
+def api_facets():
+    """Genres, rating counts and item counts for the configured libraries.
+
+    Answers 202 with ready=false while the libraries are still being fetched.
+    """
+    if not session.get("plex_token") or not session.get("plex_server_url"):
+        return jsonify({'error': 'Not connected to Plex'}), 400
+    movies_libraries, tvshows_libraries = get_configured_libraries(load_config())
+    library = get_library_index(get_library_keys(movies_libraries + tvshows_libraries), wait=False)
+    if library is None:
+        return jsonify({'ready': False}), 202
+    return jsonify(dict(library.facets(), ready=True))
+
+@app.route('/api/spin', methods=['POST'])
+@api_auth_required
+def api_spin():
+    """Spin without rendering the page.
+
+    Takes the picker's filters as a JSON object plus ``n``, the number of
+    picks. Answers with a JSON object, or with one JSON item per line when
+    the client asks for ``application/x-ndjson``. API-key clients share one
+    spin state; browser sessions use their own but the cookie is not touched.
+    """
+    body = request.get_json(silent=True)
+    if body is None:
+        body = {}
+    if not isinstance(body, dict):
+        return jsonify({'error': 'The request body must be a JSON object'}), 400
+    text_filters = {name: body.get(name) or default for name, default in
+                    (('media_type', 'both'), ('genre', ''), ('rating', ''), ('keyword', ''))}
+    for name, value in text_filters.items():
+        if not isinstance(value, str):
+            return jsonify({'error': f'{name} must be a string'}), 400
+    if text_filters['media_type'] not in ('movie', 'show', 'both'):
+        return jsonify({'error': 'media_type must be movie, show or both'}), 400
+    for name in ('unwatched', 'recent_releases'):
+        if body.get(name) is not None and not isinstance(body[name], bool):
+            return jsonify({'error': f'{name} must be true or false'}), 400
+    try:
+        picks = int(body.get('n', 1))
+        # float() also accepts "nan" and "inf", which would make every score comparison meaningless
+        if body.get('min_score') and not math.isfinite(float(body['min_score'])):
+            raise ValueError(body['min_score'])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'n and min_score must be numbers'}), 400
+    if not 1 <= picks <= SPIN_API_MAX_PICKS:
+        return jsonify({'error': f'n must be between 1 and {SPIN_API_MAX_PICKS}'}), 400
+    if not all(get_plex_connection()):
+        return jsonify({'error': 'Not connected to Plex'}), 400
+
+    movies_libraries, tvshows_libraries = get_configured_libraries(load_config())
+    movie_keys = get_library_keys(movies_libraries)
+    show_keys = get_library_keys(tvshows_libraries)
+    if not movie_keys and not show_keys:
+        return jsonify({'error': 'No libraries configured'}), 400
+
+    filters = {
+        'media_type': text_filters['media_type'],
+        'genre': text_filters['genre'],
+        'rating': text_filters['rating'],
+        'keyword': text_filters['keyword'],
+        'min_score': str(body.get('min_score') or ''),
+        'unwatched': body.get('unwatched') is True,
+        'recent_releases': body.get('recent_releases') is True
+    }
+    state_id = session.get('state_id') or API_STATE_ID
+    spin_state = load_spin_state(state_id)
+    section_keys = spin_section_keys(filters['media_type'], movie_keys, show_keys)
+    with SPIN_SECONDS.time(source='api'):
+        selected, bag = run_spin(movie_keys + show_keys, section_keys, filters, picks, state_id, spin_state['seen_epoch'])
+    server_url, token = get_plex_connection()
+    machine_id = get_machine_identifier(server_url, token)
+    summary = {'total_matching': bag.total_matching, 'remaining': 0 if bag.repeating else len(bag),
+               'all_seen': bag.repeating}
+    # Sampled spins may only know an upper bound for the number of matches
+    upper_bound = isinstance(bag, SpinSample) and bag.upper_bound
+    if state_id == API_STATE_ID:
+        # Keeps the API state from being pruned while it's in use
+        spin_state.update(summary, filters=filters, results=[])
+        save_spin_state(state_id, spin_state)
+
+    if request.accept_mimetypes.best == 'application/x-ndjson':
+        def generate():
+            for item in selected:
+                yield json.dumps(build_item_data(item, server_url, machine_id)) + '\n'
+        headers = {'X-Total-Matching': str(summary['total_matching']), 'X-Remaining': str(summary['remaining'])}
+        if upper_bound:
+            headers['X-Total-Matching-Upper-Bound'] = 'true'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers=headers)
+    return jsonify(dict(summary, total_matching_upper_bound=upper_bound,
+                        results=[build_item_data(item, server_url, machine_id) for item in selected]))
+
+@app.route('/metrics')
+@api_auth_required
+def metrics():
+    """Prometheus metrics for all workers"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/server_libraries/<path:server_uri>')
 @login_required
@@ -638,32 +2995,68 @@ def get_server_libraries(server_uri):
         return jsonify({'error': 'Server not found'}), 404
     
     try:
-        print(f"[MediaRoulette] Fetching libraries from server: {server_uri}")
-        lib_response = requests.get(
-            f"{server_uri}/library/sections",
+        log.info("Fetching libraries from server: %s", server_uri)
+        lib_response = plex_get(
+            server_uri, '/library/sections',
             headers={'Accept': 'application/json'},
             params={'X-Plex-Token': selected_server['accessToken']},
             timeout=15
         )
         if lib_response.ok:
             libraries = lib_response.json().get('MediaContainer', {}).get('Directory', [])
-            print(f"[MediaRoulette] Found {len(libraries)} libraries on {selected_server['name']}")
+            log.info("Found %d libraries on %s", len(libraries), selected_server['name'])
             return jsonify({'libraries': libraries})
         else:
-            print(f"[MediaRoulette] Failed to fetch libraries: {lib_response.status_code}")
+            log.warning("Failed to fetch libraries: %s", lib_response.status_code)
             return jsonify({'error': f'Failed to fetch libraries: {lib_response.status_code}'}), 500
     except requests.exceptions.Timeout:
-        print(f"[MediaRoulette] Timeout connecting to {server_uri}")
+        log.warning("Timeout connecting to %s", server_uri)
         return jsonify({'error': 'Connection timed out'}), 504
     except Exception as e:
-        print(f"[MediaRoulette] Error fetching libraries: {e}")
+        log.warning("Error fetching libraries: %s", plex_error(e))
         return jsonify({'error': 'An unexpected error occurred'}), 500
 
+# Plex webhook events that can change which items match a spin
+PLEX_WEBHOOK_EVENTS = {'library.new', 'library.on.deck', 'media.scrobble', 'media.rate'}
+
+@app.route('/webhook/plex', methods=['POST'])
+def plex_webhook():
+    """Refresh just the affected section when Plex reports a library change"""
+    config = load_config()
+    secret = config.get('webhook_secret')
+    if not secret or not hmac.compare_digest(request.args.get('token', ''), secret):
+        return jsonify({'status': 'error', 'message': 'Invalid webhook token'}), 403
+
+    # Plex posts multipart/form-data with the event JSON in the "payload" field
+    try:
+        payload = json.loads(request.form.get('payload') or request.get_data(as_text=True) or '{}')
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid payload'}), 400
+    if not isinstance(payload, dict):
+        return jsonify({'status': 'error', 'message': 'Invalid payload'}), 400
+
+    event = payload.get('event')
+    metadata = payload.get('Metadata')
+    if not isinstance(metadata, dict):
+        return jsonify({'status': 'ignored'})
+    section_key = str(metadata.get('librarySectionID', ''))
+    if event not in PLEX_WEBHOOK_EVENTS or not section_key:
+        return jsonify({'status': 'ignored'})
+
+    for server_url, token, key in _configured_sections():
+        if str(key) == section_key:
+            log.info("Webhook %s: refreshing library %s", event, key)
+            schedule_library_refresh(server_url, token, key, force=True)
+            return jsonify({'status': 'refreshing'})
+    return jsonify({'status': 'ignored'})
+
 @app.route('/settings', methods=['GET', 'POST'])
 @login_required
 def settings():
     config = load_config()
     if request.method == 'POST':
+        previous_server_url = config.get('plex_server_url')
+        previous_sections = [lib.get('key') for lib in config.get('plex_libraries', [])]
         server_uri = request.form.get('plex_server_url')
         selected_server = next((s for s in config.get('plex_servers', []) if s['uri'] == server_uri), None)
         config['plex_server_url'] = selected_server['uri'] if selected_server else server_uri
@@ -680,23 +3073,36 @@ def settings():
         
         config['default_theme'] = request.form.get('default_theme', 'dark')
         config['enable_history'] = 'enable_history' in request.form
+        try:
+            history_limit = min(max(int(request.form.get('history_limit', '')), 1), MAX_SESSION_LIMIT)
+        except ValueError:
+            history_limit = get_history_limit(config)
+        if history_limit != get_history_limit(config):
+            resize_pick_history(history_limit)
+        config['history_limit'] = history_limit
         
         # Fetch and save libraries for the selected server
         if selected_server:
             try:
-                lib_response = requests.get(
-                    f"{selected_server['uri']}/library/sections",
+                lib_response = plex_get(
+                    selected_server['uri'], '/library/sections',
                     headers={'Accept': 'application/json'},
                     params={'X-Plex-Token': selected_server['accessToken']},
                     timeout=15
                 )
                 if lib_response.ok:
                     config['plex_libraries'] = lib_response.json().get('MediaContainer', {}).get('Directory', [])
-                    print(f"[MediaRoulette] Saved {len(config['plex_libraries'])} libraries for {selected_server['name']}")
+                    log.info("Saved %d libraries for %s", len(config['plex_libraries']), selected_server['name'])
             except Exception as e:
-                print(f"[MediaRoulette] Failed to fetch libraries on save: {e}")
+                log.warning("Failed to fetch libraries on save: %s", plex_error(e))
         
         save_config(config)
+        # Cached sections are keyed by server, so only a server switch leaves
+        # any behind; a changed library selection just uses other sections
+        if previous_server_url and previous_server_url != config.get('plex_server_url'):
+            clear_library_cache(previous_server_url, previous_sections)
+        if config.get('plex_server_url'):
+            get_machine_identifier(config['plex_server_url'], config.get('plex_token'))
 
         session['plex_token'] = config.get('plex_token')
         session['plex_server_url'] = config.get('plex_server_url')
@@ -704,8 +3110,17 @@ def settings():
 
         return redirect(url_for('index'))
 
+    for secret_key in ('webhook_secret', 'api_key'):
+        if not config.get(secret_key):
+            config[secret_key] = secrets.token_urlsafe(24)
+    save_config(config)
+
     return render_template('settings.html',
                            config=config,
+                           webhook_url=url_for('plex_webhook', token=config['webhook_secret'], _external=True),
+                           api_key=config['api_key'],
+                           history_limit=get_history_limit(config),
+                           max_history_limit=MAX_SESSION_LIMIT,
                            libraries=config.get('plex_libraries', []),
                            servers=config.get('plex_servers', []),
                            default_theme=config.get("default_theme", "dark"))
@@ -713,18 +3128,23 @@ def settings():
 @app.route('/watchlist', methods=['GET', 'POST'])
 @login_required
 def watchlist():
+    page = max(request.args.get('page', 1, type=int), 1)
     if request.method == 'POST':
-        title = request.form.get('title')
-        year = request.form.get('year')
-        if title and year:
-            watchlist = load_watchlist()
-            updated = [item for item in watchlist if not (item['title'] == title and str(item['year']) == str(year))]
-            with open(WATCHLIST_FILE, 'w') as f:
-                json.dump(updated, f, indent=2)
-        return redirect(url_for('watchlist'))
+        item_key = request.form.get('item_key')
+        if item_key:
+            remove_watchlist_item(item_key)
+        return redirect(url_for('watchlist', page=page))
 
+    items, total = load_watchlist_page(page)
+    pages = -(-total // WATCHLIST_PAGE_SIZE)
+    if page > 1 and page > pages:
+        # The last item on the last page was removed
+        return redirect(url_for('watchlist', page=max(pages, 1)))
     return render_template('watchlist.html',
-                           watchlist=load_watchlist(),
+                           watchlist=items,
+                           total=total,
+                           page=page,
+                           pages=pages,
                            default_theme=load_config().get("default_theme", "dark"))
 
 if __name__ == '__main__':
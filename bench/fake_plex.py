@@ -0,0 +1,191 @@
+"""Stand-in Plex Media Server for benchmarks.
+
+Serves synthetic movie and TV show sections with the endpoints and query
+parameters MediaRoulette uses: /identity, /library/sections,
+/library/sections/{key}/all (paging, filters, sort=random),
+/library/sections/{key}/genre and /photo/:/transcode. Every response can
+be delayed to simulate a remote server, and /_bench/stats reports how many
+requests and bytes were served.
+
+    python bench/fake_plex.py --port 32400 --movies 10000 --shows 2000 --latency 0.05
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+GENRES = ['Action', 'Adventure', 'Animation', 'Comedy', 'Crime', 'Documentary', 'Drama', 'Family',
+          'Fantasy', 'History', 'Horror', 'Music', 'Mystery', 'Romance', 'Science Fiction',
+          'Thriller', 'War', 'Western', 'Action/Adventure', 'Sci-Fi & Fantasy']
+MOVIE_RATINGS = ['G', 'PG', 'PG-13', 'R', 'NC-17', 'Not Rated', None]
+SHOW_RATINGS = ['TV-Y', 'TV-Y7', 'TV-G', 'TV-PG', 'TV-14', 'TV-MA', None]
+WORDS = ('a an the of in on to and with for from after before during young old family friends detective '
+         'ship space station planet survival heist robot love war ocean island dragon time travel murder '
+         'zombie city village secret journey mission crew captain doctor teacher king queen kingdom '
+         'ghost house night summer winter storm river mountain desert forest school team game music '
+         'band dream memory future past revenge escape rescue treasure map spy agent killer truth').split()
+MACHINE_IDENTIFIER = 'benchmark-fake-plex'
+
+SECTIONS = {}
+STATS = {'requests': 0, 'bytes': 0}
+_stats_lock = threading.Lock()
+LATENCY = 0.0
+
+def make_items(count, section_key, item_type, first_rating_key, seed):
+    rnd = random.Random(seed)
+    now = int(time.time())
+    items = []
+    for i in range(count):
+        rating_key = first_rating_key + i
+        year = rnd.randint(1950, 2025)
+        added_at = now - rnd.randint(0, 10 * 365 * 86400)
+        item = {
+            'ratingKey': str(rating_key),
+            'key': f'/library/metadata/{rating_key}',
+            'librarySectionID': int(section_key),
+            'type': item_type,
+            'title': ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 4))).title(),
+            'year': year,
+            'summary': ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(20, 80))).capitalize() + '.',
+            'thumb': f'/library/metadata/{rating_key}/thumb/{added_at}',
+            'art': f'/library/metadata/{rating_key}/art/{added_at}',
+            'addedAt': added_at,
+            'updatedAt': added_at + rnd.randint(0, 86400),
+            'originallyAvailableAt': f'{year}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}',
+            'duration': rnd.randint(20, 180) * 60000,
+            'studio': rnd.choice(['A24', 'Pixar', 'HBO', 'BBC', 'Netflix', 'Warner Bros.']),
+            'Genre': [{'tag': g} for g in rnd.sample(GENRES, rnd.randint(0, 4))],
+            'Director': [{'tag': f'Director {rnd.randint(1, 500)}'}],
+            'Role': [{'tag': f'Actor {rnd.randint(1, 5000)}'} for _ in range(rnd.randint(2, 6))],
+        }
+        content_rating = rnd.choice(SHOW_RATINGS if item_type == 'show' else MOVIE_RATINGS)
+        if content_rating:
+            item['contentRating'] = content_rating
+        if rnd.random() < 0.85:
+            item['audienceRating'] = round(rnd.uniform(1, 10), 1)
+            item['audienceRatingImage'] = 'rottentomatoes://image.rating.upright'
+        if item_type == 'show':
+            item['leafCount'] = rnd.randint(1, 120)
+            item['viewedLeafCount'] = rnd.choice([0, 0, 0, rnd.randint(0, item['leafCount']), item['leafCount']])
+        elif rnd.random() < 0.35:
+            item['viewCount'] = rnd.randint(1, 5)
+            item['lastViewedAt'] = added_at + rnd.randint(0, 86400 * 30)
+        items.append(item)
+    return items
+
+def _matches(item, name, value):
+    op = None
+    for suffix in ('>>', '<<'):
+        if name.endswith(suffix):
+            name, op = name[:-2], suffix
+    if name == 'type':
+        return item['type'] == {'1': 'movie', '2': 'show'}.get(value)
+    if name == 'unwatched':
+        # Like Plex: for shows this means "has unwatched episodes"
+        if item['type'] == 'show':
+            return item.get('viewedLeafCount', 0) < item.get('leafCount', 0)
+        return not item.get('viewCount')
+    if name == 'genre':
+        ids = {str(GENRES.index(g['tag']) + 1) for g in item.get('Genre', [])}
+        return bool(ids & set(value.split(',')))
+    field = item.get(name)
+    if field is None:
+        return False
+    if op:
+        if isinstance(field, str):
+            return field > value if op == '>>' else field < value
+        return field > float(value) if op == '>>' else field < float(value)
+    return str(field) in value.split(',')
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, body, content_type='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        with _stats_lock:
+            STATS['requests'] += 1
+            STATS['bytes'] += len(body)
+        if LATENCY:
+            time.sleep(LATENCY)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = dict(parse_qsl(url.query))
+        path = url.path
+        if path == '/_bench/stats':
+            body = json.dumps(STATS).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if path in ('/', '/identity'):
+            return self.send({'MediaContainer': {'machineIdentifier': MACHINE_IDENTIFIER}})
+        if path == '/library/sections':
+            return self.send({'MediaContainer': {'Directory': [
+                {'key': key, 'title': section['title'], 'type': section['type']} for key, section in SECTIONS.items()]}})
+        match = re.match(r'/library/sections/(\w+)/genre$', path)
+        if match:
+            return self.send({'MediaContainer': {'Directory': [
+                {'key': str(i + 1), 'fastKey': f'/library/sections/{match.group(1)}/all?genre={i + 1}', 'title': g}
+                for i, g in enumerate(GENRES)]}})
+        match = re.match(r'/library/sections/(\w+)/all$', path)
+        if match and match.group(1) in SECTIONS:
+            items = SECTIONS[match.group(1)]['items']
+            start = int(query.pop('X-Plex-Container-Start', 0))
+            size = int(query.pop('X-Plex-Container-Size', len(items)))
+            sort = query.pop('sort', None)
+            for name in ('X-Plex-Token', 'includeFields'):
+                query.pop(name, None)
+            for name, value in query.items():
+                items = [item for item in items if _matches(item, name, value)]
+            if sort == 'random':
+                items = random.sample(items, len(items))
+            page = items[start:start + size]
+            container = {'size': len(page), 'totalSize': len(items), 'offset': start}
+            if page:
+                container['Metadata'] = page
+            return self.send({'MediaContainer': container})
+        if path == '/photo/:/transcode':
+            return self.send(b'\xff\xd8\xff\xe0' + bytes(8 * 1024), 'image/jpeg')
+        self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+def serve(port, movies, shows, latency=0.0, host='127.0.0.1'):
+    """Start the server in a background thread and return it"""
+    global LATENCY
+    LATENCY = latency
+    SECTIONS['1'] = {'title': 'Movies', 'type': 'movie', 'items': make_items(movies, '1', 'movie', 1, seed=1)}
+    SECTIONS['2'] = {'title': 'TV Shows', 'type': 'show', 'items': make_items(shows, '2', 'show', 10_000_000, seed=2)}
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=32400)
+    parser.add_argument('--movies', type=int, default=10000)
+    parser.add_argument('--shows', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    args = parser.parse_args()
+    serve(args.port, args.movies, args.shows, args.latency)
+    print(f"Fake Plex serving {args.movies} movies and {args.shows} shows on http://127.0.0.1:{args.port}", flush=True)
+    while True:
+        time.sleep(3600)
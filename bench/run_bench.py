@@ -0,0 +1,206 @@
+"""Spin latency benchmark.
+
+For every library size this starts bench/fake_plex.py, then runs the app in
+a fresh process with its own scratch data directory and drives it through
+Flask's test client:
+
+  page_cold     first page load, before anything is cached
+  spin_cold     first spin, before any library is synced (sampled from Plex)
+  page          page loads once the libraries are cached
+  spin          one spin for every combination of the picker's filters
+  api_spin      /api/spin with n=10 for the same combinations
+  watchlist_add adding items to the watchlist
+  export_csv    watchlist export as CSV
+  export_json   watchlist export as JSON
+
+and reports p50/p99 latency, requests per second and bytes fetched from
+Plex for each phase, plus the peak RSS of the app process and everything
+fetched from Plex in total (background refreshes included).
+
+    python bench/run_bench.py --sizes 1000,10000,100000 --latency 0.02
+"""
+import argparse
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+FILTERS = {
+    'media_type': ['both', 'movie', 'show'],
+    'genre': ['', 'Drama', 'Action/Adventure'],
+    'rating': ['', 'PG-13', 'TV-MA'],
+    'min_score': ['', '7'],
+    'keyword': ['', 'robot'],
+    'unwatched': [False, True],
+    'recent_releases': [False, True],
+    'show_three': [False, True],
+}
+
+def filter_combinations():
+    names = list(FILTERS)
+    for values in itertools.product(*(FILTERS[name] for name in names)):
+        yield dict(zip(names, values))
+
+def spin_form(filters):
+    form = {name: value for name, value in filters.items() if isinstance(value, str)}
+    form.update({name: 'on' for name, value in filters.items() if value is True})
+    return form
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def plex_stats(plex_url):
+    with urllib.request.urlopen(f'{plex_url}/_bench/stats') as response:
+        return json.load(response)
+
+def run_app(plex_url, watchlist_items):
+    """Benchmark one app process; runs in the child and returns the report"""
+    from werkzeug.security import generate_password_hash
+    sys.path.insert(0, REPO_DIR)
+    import app as mediaroulette
+
+    mediaroulette.save_users({'bench': {'password_hash': generate_password_hash('bench'), 'is_admin': True}})
+    mediaroulette.save_config({
+        'plex_token': 'bench', 'plex_server_url': plex_url,
+        'plex_servers': [{'name': 'Fake Plex', 'uri': plex_url, 'accessToken': 'bench',
+                          'machineIdentifier': 'benchmark-fake-plex'}],
+        'plex_libraries': [{'key': '1', 'title': 'Movies', 'type': 'movie'},
+                           {'key': '2', 'title': 'TV Shows', 'type': 'show'}],
+        'movies_libraries': ['Movies'], 'tvshows_libraries': ['TV Shows'], 'enable_history': True,
+    })
+    # Hold the background refresher back until the cold phases are done, or
+    # it syncs the libraries first and spin_cold measures a cached spin
+    start_library_refresher = mediaroulette.start_library_refresher
+    mediaroulette.start_library_refresher = lambda: None
+    client = mediaroulette.app.test_client()
+    client.post('/login', data={'username': 'bench', 'password': 'bench'})
+
+    phases = {}
+
+    def measure(phase, requests):
+        before = plex_stats(plex_url)
+        timings = []
+        started = time.perf_counter()
+        for send in requests:
+            request_started = time.perf_counter()
+            response = send()
+            # Streamed responses (exports, NDJSON) are only produced as the body is read
+            response.get_data()
+            response.close()
+            timings.append(time.perf_counter() - request_started)
+            if response.status_code >= 400:
+                raise RuntimeError(f'{phase}: HTTP {response.status_code}')
+        elapsed = time.perf_counter() - started
+        after = plex_stats(plex_url)
+        phases[phase] = {
+            'requests': len(timings),
+            'p50_ms': percentile(timings, 50) * 1000,
+            'p99_ms': percentile(timings, 99) * 1000,
+            'req_per_s': len(timings) / elapsed if elapsed else 0.0,
+            'plex_requests': after['requests'] - before['requests'],
+            'plex_bytes': after['bytes'] - before['bytes'],
+        }
+
+    combinations = list(filter_combinations())
+    measure('page_cold', [lambda: client.get('/')])
+    measure('spin_cold', [lambda: client.post('/', data={'media_type': 'both'})])
+    if not phases['spin_cold']['plex_requests']:
+        raise RuntimeError('spin_cold was served without asking Plex')
+    mediaroulette.start_library_refresher = start_library_refresher
+    start_library_refresher()
+
+    deadline = time.monotonic() + 600
+    while client.get('/api/facets').status_code == 202:
+        if time.monotonic() > deadline:
+            raise RuntimeError('libraries did not finish loading')
+        time.sleep(0.05)
+
+    measure('page', [lambda: client.get('/')] * 50)
+    measure('spin', [lambda f=f: client.post('/', data=spin_form(f)) for f in combinations])
+    measure('api_spin', [lambda f=f: client.post('/api/spin', json=dict(f, n=10))
+                         for f in combinations if not f['show_three']])
+    measure('watchlist_add', [lambda i=i: client.post('/', data={
+        'add_to_watchlist': 'true', 'saved_title': f'Bench Item {i}', 'saved_year': str(1950 + i % 75),
+        'saved_rating_key': str(i + 1), 'saved_summary': 'x' * 200, 'saved_genres': 'Drama, Comedy',
+        'saved_media_type': 'Movie'}) for i in range(watchlist_items)])
+    measure('export_csv', [lambda: client.get('/export_watchlist?format=csv')] * 20)
+    measure('export_json', [lambda: client.get('/export_watchlist?format=json')] * 20)
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Includes background refreshes that fell between phases
+    plex_total = plex_stats(plex_url)
+    return {'phases': phases, 'peak_rss_mb': peak_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024),
+            'plex_requests': plex_total['requests'], 'plex_bytes': plex_total['bytes']}
+
+def wait_for(url, timeout=120):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(url).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+def bench_size(size, args):
+    """Start a fake Plex server with `size` items and benchmark a fresh app process against it"""
+    shows = size // 5
+    plex_url = f'http://127.0.0.1:{args.port}'
+    plex = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'fake_plex.py'), '--port', str(args.port),
+                             '--movies', str(size - shows), '--shows', str(shows), '--latency', str(args.latency)],
+                            stdout=subprocess.DEVNULL)
+    try:
+        wait_for(f'{plex_url}/identity')
+        with tempfile.TemporaryDirectory(prefix='mediaroulette-bench-') as data_dir:
+            env = dict(os.environ, DATA_DIR=data_dir, LOG_LEVEL=os.environ.get('LOG_LEVEL', 'WARNING'))
+            child = subprocess.run([sys.executable, __file__, '--child', plex_url,
+                                    '--watchlist-items', str(args.watchlist_items)],
+                                   env=env, stdout=subprocess.PIPE, check=True, text=True)
+        return json.loads(child.stdout.strip().splitlines()[-1])
+    finally:
+        plex.terminate()
+        plex.wait()
+
+def print_report(size, report):
+    print(f"\n{size:,} items  (peak RSS {report['peak_rss_mb']:.0f} MB, "
+          f"{report['plex_requests']} Plex requests / {report['plex_bytes'] / 1024:.0f} KB in total)")
+    print(f"  {'phase':<14}{'requests':>9}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>10}{'plex reqs':>11}{'plex KB':>11}")
+    for phase, row in report['phases'].items():
+        print(f"  {phase:<14}{row['requests']:>9}{row['p50_ms']:>10.1f}{row['p99_ms']:>10.1f}"
+              f"{row['req_per_s']:>10.1f}{row['plex_requests']:>11}{row['plex_bytes'] / 1024:>11.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000', help='comma-separated library sizes')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the fake Plex server adds to every response')
+    parser.add_argument('--port', type=int, default=32499, help='port for the fake Plex server')
+    parser.add_argument('--watchlist-items', type=int, default=200, help='items added to the watchlist')
+    parser.add_argument('--json', metavar='PATH', help='also write the results to this file')
+    parser.add_argument('--child', metavar='PLEX_URL', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_app(args.child, args.watchlist_items)))
+        return
+
+    results = {}
+    for size in (int(s) for s in args.sizes.split(',')):
+        results[size] = bench_size(size, args)
+        print_report(size, results[size])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'latency': args.latency, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
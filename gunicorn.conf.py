@@ -0,0 +1,27 @@
+# Gunicorn settings used by the Docker image. Every value can be overridden
+# with an environment variable.
+#
+# The default gevent workers patch socket I/O, so a request waiting on a slow
+# Plex server only parks itself: the same worker keeps serving logins,
+# the watchlist and static files in the meantime. CPU-bound work is not
+# interleaved, though: while a worker parses and indexes a full library sync
+# (the first one, then every LIBRARY_FULL_SYNC_INTERVAL) its other requests
+# wait, which takes a few seconds for libraries of around 100k items.
+# Incremental syncs only touch the changed items and are short. Set
+# GUNICORN_WORKER_CLASS=gthread to use a thread pool instead, whose threads
+# take turns during such work, or sync for the old one-request-per-worker
+# behaviour.
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+
+# Concurrent requests per worker: worker_connections for gevent, threads for
+# gthread. Only set threads for gthread, since gunicorn turns sync workers
+# into gthread ones whenever threads is above 1.
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+if worker_class == 'gthread':
+    threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))